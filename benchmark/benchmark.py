@@ -0,0 +1,208 @@
+"""
+Offline benchmark of the htmlgen compute and serialization path.
+
+Synthetic leaderboards are served from an in-memory cache and run through
+the same steps as aocgen.compute_artifacts, timing each stage and
+measuring its peak memory. Nothing is read from or written to AWS.
+
+    python benchmark/benchmark.py              # compare with benchmark/baseline.json
+    python benchmark/benchmark.py --record     # record a new baseline
+
+The baseline is only meaningful on the machine it was recorded on.
+"""
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import sys
+import time
+import tracemalloc
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "htmlgen"), str(ROOT / "shared" / "python")]
+os.environ.setdefault("debug", "WARNING")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+# The baseline is recorded with the column-wise tables.
+os.environ.setdefault("TABLE_FORMAT", "2")
+
+import aocgen  # noqa E402
+import scoreboard  # noqa E402
+import scores  # noqa E402
+import synthetic  # noqa E402
+from jsextractor import jsextractor  # noqa E402
+from scoreboard import LeaderBoard, ScoreboardRepresentation, global_score_index  # noqa E402
+from snapshot import BoardSnapshot  # noqa E402
+from tieredcache import TieredCache, MemoryTier  # noqa E402
+
+BASELINE = pathlib.Path(__file__).resolve().parent / "baseline.json"
+
+# name -> arguments of synthetic.make_leaderboard and the generation
+SCENARIOS = {
+    "small": {"members": 20},
+    "medium": {"members": 200},
+    "large": {"members": 1000},
+    "partial": {"members": 200, "days": 7},
+    "nopoints": {"members": 200, "nopoint_days": [1, 2]},
+    "ties": {"members": 200, "ties": 0.3},
+}
+
+ENGINES = ["python", "numpy"]
+
+
+class SyntheticDownloader():
+    """
+    Stands in for scores.Downloader, serving generated leaderboards.
+    """
+    def __init__(self, raw: str):
+        self.raw = raw
+
+    def get_data(self, representation: scores.DataRepresentation) -> str:
+        return self.raw
+
+
+def run_stages(raw: str, settings: dict, engine: str, measure) -> dict:
+    """
+    Run the compute path once, measure(func) -> (value, measurement) runs each stage.
+
+    Returns:
+        dict: map <stage> -> measurement
+    """
+    results = {}
+
+    def stage(name, func):
+        value, results[name] = measure(func)
+        return value
+
+    year = str(settings.get("year", 2020))
+    retriever = scores.DataRetriever(
+        SyntheticDownloader(raw),
+        TieredCache([MemoryTier(1 << 30)]))
+    representation = ScoreboardRepresentation("42", year)
+    retriever.get_raw(representation)
+
+    raw = stage("fetch", lambda: retriever.get_raw(representation))
+    board_snapshot = stage("parse", lambda: BoardSnapshot.parse(raw))
+
+    def build():
+        leaderboard = LeaderBoard(
+            title="Benchmark",
+            snapshot=board_snapshot,
+            year=year,
+            highestday=settings.get("days", 25),
+            namemap={"Player 1": "The first"},
+            uuid="benchmark",
+            global_scores=settings["global_scores"],
+            nopoint_days=settings.get("nopoint_days", []),
+            engine=engine)
+        leaderboard.update_global_scores()
+        return leaderboard
+    leaderboard = stage("build", build)
+    stage("stats", leaderboard.post_process_stats)
+    extravars = {"aoc_fetch": "", "generated": "", "nopoints": settings.get("nopoint_days", [])}
+    artifacts = stage(
+        "serialize",
+        lambda: jsextractor(leaderboard, extravars, table_format=aocgen.table_format).artifacts())
+    stage(
+        "compress",
+        lambda: [aocgen.compress(_.encode('utf-8'), aocgen.content_encoding) for _ in artifacts.values()])
+    return results
+
+
+def timed(func) -> tuple:
+    start = time.perf_counter()
+    value = func()
+    return value, time.perf_counter() - start
+
+
+def traced(func) -> tuple:
+    tracemalloc.start()
+    try:
+        value = func()
+        return value, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(name: str, engine: str, repeat: int) -> dict:
+    """
+    Returns:
+        dict: map <stage> -> {"seconds": <fastest run>, "peak_kib": <peak of allocations during the stage>}
+    """
+    arguments = dict(SCENARIOS[name])
+    settings = {_: arguments.pop(_) for _ in ["nopoint_days"] if _ in arguments}
+    settings.update({_: arguments[_] for _ in ["days", "year"] if _ in arguments})
+    board = synthetic.make_leaderboard(**arguments)
+    global_scores = synthetic.make_global_scores(board)
+    settings["global_scores"] = {"scores": global_scores, "index": global_score_index(global_scores)}
+    raw = json.dumps(board)
+
+    runs = [run_stages(raw, settings, engine, timed) for _ in range(repeat)]
+    memory = run_stages(raw, settings, engine, traced)
+    return {
+        stage: {
+            "seconds": round(min(run[stage] for run in runs), 6),
+            "peak_kib": memory[stage] // 1024}
+        for stage in memory}
+
+
+def regressions(result: dict, baseline: dict, tolerance: float, noise: float) -> list:
+    """
+    Compare result with baseline, a stage regresses if it is more than tolerance
+    slower (and more than noise seconds) or uses more than tolerance more memory.
+    """
+    found = []
+    for stage, measured in result.items():
+        base = baseline.get(stage)
+        if base is None:
+            continue
+        slower = measured["seconds"] - base["seconds"]
+        if slower > noise and measured["seconds"] > base["seconds"] * (1 + tolerance):
+            found.append(f"{stage}: {base['seconds']:.4f}s -> {measured['seconds']:.4f}s")
+        if measured["peak_kib"] > max(base["peak_kib"] * (1 + tolerance), base["peak_kib"] + 64):
+            found.append(f"{stage}: {base['peak_kib']} KiB -> {measured['peak_kib']} KiB")
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the htmlgen compute path offline.")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="Default: all")
+    parser.add_argument("--engine", action="append", choices=ENGINES, help="Default: all")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per scenario, the fastest counts.")
+    parser.add_argument("--record", action="store_true", help=f"Write the results to {BASELINE.name}.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression.")
+    parser.add_argument("--noise", type=float, default=0.002, help="Ignore time differences below this (seconds).")
+    args = parser.parse_args()
+
+    engines = args.engine or [_ for _ in ENGINES if _ != "numpy" or scoreboard.columnar is not None]
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    results = {}
+    failed = []
+    for name in args.scenario or SCENARIOS:
+        for engine in engines:
+            key = f"{name}/{engine}"
+            results[key] = run_scenario(name, engine, args.repeat)
+            print(key)
+            for stage, measured in results[key].items():
+                base = baseline.get("results", {}).get(key, {}).get(stage)
+                compared = f" (baseline {base['seconds']:.4f}s, {base['peak_kib']} KiB)" if base else ""
+                print(f"  {stage:<10} {measured['seconds']:.4f}s {measured['peak_kib']:>8} KiB{compared}")
+            found = regressions(results[key], baseline.get("results", {}).get(key, {}), args.tolerance, args.noise)
+            failed.extend(f"{key} {_}" for _ in found)
+
+    if args.record:
+        recorded = {
+            "recorded": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "python": sys.version.split()[0],
+            "results": {**baseline.get("results", {}), **results}}
+        BASELINE.write_text(json.dumps(recorded, indent=2) + "\n")
+        print(f"Recorded {BASELINE}")
+        return 0
+
+    for _ in failed:
+        print(f"REGRESSION {_}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import datetime
+import math
+import random
+
+
+def publish_time(year: int, day: int) -> int:
+    return int(datetime.datetime(year=year, month=12, day=day, hour=6).timestamp())
+
+
+def make_leaderboard(
+        *,
+        members: int = 200,
+        year: int = 2020,
+        days: int = 25,
+        seed: int = 0,
+        owner_id: int = 42,
+        idle: float = 0.2,
+        solve_rate: float = 0.9,
+        dropoff: float = 0.04,
+        second_star: float = 0.85,
+        ties: float = 0.02,
+        anonymous: float = 0.1) -> dict:
+    """
+    Generate a private leaderboard in the format of the AoC json api.
+
+    Args:
+        members (int): Number of members.
+        year (int): Year of the event.
+        days (int): Number of unlocked days (1-25).
+        seed (int): Seed of the random generator, the same arguments give the same board.
+        owner_id (int): Id of the board.
+        idle (float): Share of members that never solve anything.
+        solve_rate (float): Chance that the best members solve day 1.
+        dropoff (float): Relative decline of the solve rate per day.
+        second_star (float): Chance to solve the second star after the first.
+        ties (float): Chance that a star is completed the same second as an earlier one.
+        anonymous (float): Share of members without a name.
+
+    Returns:
+        dict: The leaderboard.
+    """
+    rnd = random.Random(seed)
+    solved = {}
+    board = {}
+    for i in range(members):
+        memberid = 1000000 + i
+        skill = 0 if rnd.random() < idle else rnd.betavariate(2, 2)
+        levels = {}
+        for day in range(1, days + 1):
+            if rnd.random() >= solve_rate * skill * (1 - dropoff) ** (day - 1):
+                continue
+            # Later days are harder, better members are faster.
+            difficulty = math.log(600 * (1 + day / 5)) - skill
+            t = publish_time(year, day)
+            level = {}
+            for star in range(1, 3):
+                if star == 2 and rnd.random() >= second_star:
+                    break
+                earlier = solved.get((day, star))
+                if earlier and rnd.random() < ties:
+                    t = rnd.choice(earlier)
+                else:
+                    t += int(rnd.lognormvariate(difficulty - (star - 1), 1)) + 1
+                solved.setdefault((day, star), []).append(t)
+                level[str(star)] = {"get_star_ts": t, "star_index": rnd.randint(0, 10 ** 6)}
+            levels[str(day)] = level
+
+        board[str(memberid)] = {
+            "id": memberid,
+            "name": None if rnd.random() < anonymous else f"Player {i}",
+            "local_score": 0,
+            "global_score": rnd.choice([0] * 19 + [rnd.randint(1, 500)]),
+            "stars": sum(len(_) for _ in levels.values()),
+            "last_star_ts": max([s["get_star_ts"] for level in levels.values() for s in level.values()], default=0),
+            "completion_day_level": levels,
+        }
+
+    # The local score as AoC computes it.
+    ranks = {}
+    for key, times in solved.items():
+        ranks[key] = {}
+        for rank, t in enumerate(sorted(times)):
+            ranks[key].setdefault(t, rank)
+    for member in board.values():
+        for day, level in member["completion_day_level"].items():
+            for star, completion in level.items():
+                member["local_score"] += members - ranks[(int(day), int(star))][completion["get_star_ts"]]
+
+    return {"owner_id": owner_id, "event": str(year), "members": board}
+
+
+def make_global_scores(leaderboard: dict, *, share: float = 0.05, seed: int = 0) -> dict:
+    """
+    Generate global leaderboards (map <day> -> [[names star 1], [names star 2]])
+    where a share of the named members of leaderboard made it to the top 100.
+    """
+    rnd = random.Random(seed)
+    names = [_["name"] for _ in leaderboard["members"].values() if _["name"]]
+    winners = rnd.sample(names, int(len(names) * share))
+    scores = {}
+    for day in range(1, 26):
+        stars = []
+        for _ in range(2):
+            top = [f"global {n}" for n in range(100)]
+            for name in winners:
+                if rnd.random() < 0.3:
+                    top[rnd.randrange(100)] = name
+            stars.append(top)
+        scores[day] = stars
+    return scores
+
+
+if __name__ == "__main__":
+    raise Exception("This is just a module!")
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import scores
 import logging
@@ -5,19 +6,99 @@ import os
 import boto3
 import hashlib
 import datetime
+import gzip
 import math
+import collections
+import threading
+import pathlib
 from typing import Dict, List
 from jsextractor import jsextractor
 from botocore.exceptions import ClientError
 import concurrent.futures
 
 from scoreboard import LeaderBoard, ScoreboardRepresentation
+from snapshot import BoardSnapshot, source_hash
 from s3cache import S3Cache
+from tieredcache import TieredCache, MemoryTier, DiskTier
+from pipeline import Stages
+from metrics import Metrics
+from aochttp import RateLimitExceeded
+import scheduling
+
+# Part of the fingerprint of every generation. Bump it whenever a change to the code changes the
+# artifacts (statistics, ranking, serialization), so boards with unchanged inputs are generated again.
+GENERATOR_VERSION = 2
 
 cache_bucket_name = os.environ.get("S3_DATACACHE", "scoreboard-datacache")
 html_bucket_name = os.environ.get("S3_HTML", "scoreboard-html")
 html_bucket = boto3.resource('s3').Bucket(html_bucket_name)
 s3client = boto3.client('s3')
+# "python" or "numpy" (columnar engine)
+stats_engine = os.environ.get("STATS_ENGINE", "python")
+
+# Content-Encoding of the uploaded artifacts: "gzip" or "identity".
+# The bucket is served as is over plain http, where browsers do not accept brotli.
+CONTENT_ENCODINGS = ["gzip", "identity"]
+content_encoding = os.environ.get("CONTENT_ENCODING", "gzip")
+
+# Format of the table-* artifacts, 1: list of rows, 2: column-wise.
+# Version 2 tables are uploaded as table-<name>.v2 and announced in var-config, only pages
+# that can read them request them. The version 1 files are still written next to them for
+# pages cached before version 2 existed.
+table_format = int(os.environ.get("TABLE_FORMAT", "1"))
+
+# Publish the artifacts of a board/year as one bundle object instead of separate files,
+# next to var-config (which announces the bundle to the page).
+bundle_mode = os.environ.get("BUNDLE", "") == "1"
+BUNDLE_VERSION = 1
+
+# Raw leaderboards, cached in RAM and /tmp for as long as the lambda is warm, backed by the datacache bucket.
+data_cache = TieredCache([
+    MemoryTier(int(os.environ.get("CACHE_RAM_MB", "64")) * 2**20),
+    DiskTier(
+        pathlib.Path(os.environ.get("CACHE_DIR", "/tmp/datacache")),
+        int(os.environ.get("CACHE_DISK_MB", "256")) * 2**20),
+    S3Cache(cache_bucket_name)])
+
+# Raw leaderboards of at least this size are stored as binary snapshots in the datacache bucket
+# and loaded from there instead of being parsed again. For smaller boards parsing is cheaper than the GET.
+snapshot_min_size = int(os.environ.get("SNAPSHOT_MIN_SIZE", str(64 * 1024)))
+
+
+class ComputedBoards():
+    """
+    LRU of the last computed LeaderBoard per (boardid, year), holding at most max_boards boards.
+
+    The boards only live in the memory of the process: a cold lambda (or
+    another lane or worker process) starts without them and computes all
+    days again.
+    """
+    def __init__(self, max_boards: int):
+        self.max_boards = max_boards
+        self.boards = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> LeaderBoard:
+        with self.lock:
+            if key not in self.boards:
+                return None
+            self.boards.move_to_end(key)
+            return self.boards[key]
+
+    def put(self, key: tuple, leaderboard: LeaderBoard) -> None:
+        with self.lock:
+            self.boards[key] = leaderboard
+            self.boards.move_to_end(key)
+            while len(self.boards) > self.max_boards:
+                self.boards.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.boards.clear()
+
+
+# Last computed LeaderBoard per (boardid, year), reused while the lambda is warm.
+computed_boards = ComputedBoards(int(os.environ.get("COMPUTED_BOARDS_MAX", "32")))
 
 DEFAULT_LOGLEVEL = logging.DEBUG
 debuglevel = os.environ.get("debug", "")
@@ -43,12 +124,42 @@ handler = logging.StreamHandler()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+if content_encoding not in CONTENT_ENCODINGS:
+    logger.warning(f"Unsupported CONTENT_ENCODING {content_encoding}, using gzip")
+    content_encoding = "gzip"
+
+
+class ScheduledDownloader(scores.Downloader):
+    """
+    Downloader that refuses to fetch a leaderboard again within scheduling.AOC_MIN_INTERVAL of last_fetch.
+    """
+    def __init__(self, sessionid: str = None, last_fetch: int = None):
+        super().__init__(sessionid)
+        self.last_fetch = last_fetch
 
-def get_data(representation: ScoreboardRepresentation, sessionid: str):
-    downloader = scores.Downloader(sessionid)
-    cache = S3Cache(cache_bucket_name)
-    retriever = scores.DataRetriever(downloader, cache)
-    return retriever.get_data(representation), cache.item_date(representation)
+    def get_data(self, representation: scores.DataRepresentation):
+        if self.last_fetch:
+            delay = scheduling.fetch_delay(self.last_fetch, int(datetime.datetime.now().timestamp()))
+            if delay:
+                raise RateLimitExceeded(f"{representation.filename()} was fetched less than 15 minutes ago", delay)
+        return super().get_data(representation)
+
+
+def get_data(representation: ScoreboardRepresentation, sessionid: str, last_fetch: int = None):
+    """
+    Args:
+        last_fetch (int, optional): When the leaderboard was last fetched from AoC, None if unknown.
+
+    Raises:
+        RateLimitExceeded: The data has to be fetched from AoC, but may not be fetched yet.
+
+    Returns:
+        tuple: (raw data, fetch date, where the data came from: a cache tier or "aoc")
+    """
+    downloader = ScheduledDownloader(sessionid, last_fetch)
+    retriever = scores.DataRetriever(downloader, data_cache)
+    raw = retriever.get_raw(representation)
+    return raw, data_cache.item_date(representation), data_cache.source(representation)
 
 # def get_text(representation, sessionid: str = None):
 #     downloader = scores.Downloader(sessionid)
@@ -57,49 +168,238 @@ def get_data(representation: ScoreboardRepresentation, sessionid: str):
 #     return retriever.get_raw(representation)
 
 
-def get_scores(year: str, sessionid: str, boardid: str):
+def get_scores(year: str, sessionid: str, boardid: str, last_fetch: int = None):
     logger.info(f"Getting scores for {boardid} - {year}")
     representation = ScoreboardRepresentation(boardid, year)
-    return get_data(representation, sessionid)
+    return get_data(representation, sessionid, last_fetch)
 
 
-def file_upload(
-        filekey: str,
-        func) -> None:
-    logger.debug(f"Uploading {filekey}?")
-    data = func()
-    md5 = hashlib.md5(data.encode('utf-8')).hexdigest()
+def make_fingerprint(raw: str, **inputs) -> str:
+    """
+    Fingerprint everything that goes into the artifacts of a board/year:
+    the raw leaderboard from AoC and the other generation inputs.
+
+    Args:
+        raw (str): The leaderboard json as returned by AoC.
+        inputs: The other inputs (namemap, nopoint days, ...), json serializable.
+
+    Returns:
+        str: md5 hexdigest
+    """
+    md5 = hashlib.md5(raw.encode('utf-8'))
+    md5.update(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8'))
+    return md5.hexdigest()
+
+
+def compress(data: bytes, encoding: str) -> tuple:
+    """
+    Compress data for upload.
+
+    Args:
+        data (bytes): Uncompressed data.
+        encoding (str): Requested encoding, "gzip" or "identity".
+
+    Returns:
+        tuple: (compressed data, Content-Encoding actually used)
+    """
+    if encoding == "gzip":
+        return gzip.compress(data, mtime=0), "gzip"
+    return data, "identity"
+
+
+def read_manifest(prefix: str) -> dict:
+    """
+    Read the upload manifest of a board/year.
+
+    Args:
+        prefix (str): <year>/<uuid>
+
+    Returns:
+        dict: map <artifact name> -> {"md5": <md5 of uncompressed data>, "encoding": <encoding>}
+    """
     try:
-        response = s3client.head_object(
+        response = s3client.get_object(
             Bucket=html_bucket_name,
-            Key=filekey)
-        need_upload = response["Metadata"].get("md5") != md5
+            Key=f"{prefix}/manifest.json")
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except ClientError:
+        logger.debug(f"No manifest for {prefix}")
+        return {}
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable manifest for {prefix}: {e}")
+        return {}
+
+
+def write_manifest(prefix: str, manifest: dict) -> None:
+    html_bucket.put_object(
+        Body=json.dumps(manifest),
+        ContentType='application/json',
+        Key=f"{prefix}/manifest.json")
+
+
+def snapshot_key(boardid: str, year: str) -> str:
+    return f"{boardid}_{year}.snapshot"
+
+
+def load_snapshot(boardid: str, year: str, raw: str) -> BoardSnapshot:
+    """
+    Find a snapshot of the raw leaderboard, in the last computed board or in the datacache bucket.
+
+    Returns:
+        BoardSnapshot: The snapshot, None if there is no snapshot of raw.
+    """
+    source = source_hash(raw)
+    previous = computed_boards.get((boardid, year))
+    if previous is not None and previous.snapshot.source == source:
+        return previous.snapshot
+    if len(raw) < snapshot_min_size:
+        return None
+    try:
+        # The source is in the metadata of the snapshot, outdated snapshots are not downloaded.
+        head = s3client.head_object(
+            Bucket=cache_bucket_name,
+            Key=snapshot_key(boardid, year))
+        if head.get('Metadata', {}).get('source') != source:
+            logger.debug(f"Snapshot for {boardid}_{year} is outdated")
+            return None
+        response = s3client.get_object(
+            Bucket=cache_bucket_name,
+            Key=snapshot_key(boardid, year))
+        data = response['Body'].read()
+        if response.get('ContentEncoding') == 'gzip':
+            data = gzip.decompress(data)
+        stored = BoardSnapshot.loads(data)
     except ClientError:
-        need_upload = True
-    except Exception as e:
-        print(e)
+        logger.debug(f"No snapshot for {boardid}_{year}")
+        return None
+    except ValueError as e:
+        logger.warning(f"Ignoring snapshot for {boardid}_{year}: {e}")
+        return None
+    if stored.source != source:
+        logger.debug(f"Snapshot for {boardid}_{year} is outdated")
+        return None
+    logger.info(f"Using snapshot for {boardid}_{year}")
+    return stored
+
+
+def save_snapshot(boardid: str, year: str, board_snapshot: BoardSnapshot) -> None:
+    s3client.put_object(
+        Body=gzip.compress(board_snapshot.dumps(), mtime=0),
+        Bucket=cache_bucket_name,
+        ContentEncoding='gzip',
+        Key=snapshot_key(boardid, year),
+        Metadata={"source": board_snapshot.source or ""})
 
-    if need_upload:
+
+def file_upload(
+        filekey: str,
+        data: str,
+        stored: dict) -> dict:
+    """
+    Upload data unless the manifest entry stored shows it is already uploaded.
+
+    Returns:
+        dict: The manifest entry for the uploaded data.
+    """
+    logger.debug(f"Uploading {filekey}?")
+    body = data.encode('utf-8')
+    # The md5 is always computed on the uncompressed data
+    entry = {"md5": hashlib.md5(body).hexdigest(), "encoding": content_encoding}
+
+    if stored != entry:
         logger.debug(f"Pushing {filekey} to S3")
+        body, encoding = compress(body, content_encoding)
         html_bucket.put_object(
-            Body=data,
+            Body=body,
             ContentType='application/json',
+            ContentEncoding=encoding,
             Key=filekey,
-            Metadata={"md5": md5})
+            Metadata=entry)
         logger.debug("Uploading done")
     else:
         logger.debug(f"Up to date: {filekey} (no upload required)")
+    return entry
+
+
+def make_bundle(artifacts: dict) -> str:
+    """
+    Combine the artifacts into one bundle: a json header line
+    {"version": <BUNDLE_VERSION>, "artifacts": {<name>: [<start>, <end>], ...}}
+    followed by all artifacts. Offsets are in bytes from the start of the
+    second line, so a single artifact can be read with a range request.
 
+    Args:
+        artifacts (dict): map <artifact name> -> json string
 
-def generate_data(leaderboard, params: dict):
+    Returns:
+        str: The bundle.
+    """
+    offsets = {}
+    position = 0
+    for name, data in artifacts.items():
+        size = len(data.encode('utf-8'))
+        offsets[name] = [position, position + size]
+        position += size
+    header = json.dumps({"version": BUNDLE_VERSION, "artifacts": offsets})
+    return header + "\n" + "".join(artifacts.values())
+
+
+def published_artifacts(artifacts: dict) -> dict:
+    """
+    The artifacts as they are uploaded. In bundle mode that is var-config and a bundle of all artifacts.
+
+    var-config carries the generation time and tells the page whether to load the bundle, so it is
+    always uploaded on its own. The bundle holds a copy without the generation time for pages that
+    read var-config from the bundle, otherwise the bundle would change with every generation.
+
+    Args:
+        artifacts (dict): map <artifact name> -> json string
+
+    Returns:
+        dict: map <artifact name> -> json string
+    """
+    if not bundle_mode:
+        return artifacts
+    config = json.loads(artifacts["var-config"])
+    config["extravars"].pop("generated", None)
+    # Pages reading the bundle know the table format, leave out the version 1 copies of the tables.
+    bundled = {
+        name: data for name, data in artifacts.items()
+        if table_format == 1 or f"{name}.v{table_format}" not in artifacts}
+    bundled["var-config"] = json.dumps(config)
+    return {"var-config": artifacts["var-config"], "bundle": make_bundle(bundled)}
+
+
+def generate_data(leaderboard, artifacts: dict) -> tuple:
+    """
+    Upload the artifacts that changed since the last upload.
+    Outside bundle mode, a bundle left over from bundle mode is deleted.
+
+    Returns:
+        tuple: (number of artifacts uploaded, number of artifacts published)
+    """
+    prefix = f'{leaderboard.year}/{leaderboard.uuid}'
+    artifacts = published_artifacts(artifacts)
+
+    manifest = read_manifest(prefix)
     with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(
+        futures = {
+            name: executor.submit(
                 file_upload,
-                f'{leaderboard.year}/{leaderboard.uuid}/{name}.json', func)
-            for name, func in params.items()]
+                f'{prefix}/{name}.json', data, manifest.get(name, {}))
+            for name, data in artifacts.items()}
 
-    [f.result() for f in futures]
+    # Only record the new state once all uploads succeeded.
+    updated = {**manifest, **{name: f.result() for name, f in futures.items()}}
+    if not bundle_mode and "bundle" in updated:
+        logger.debug(f"Deleting {prefix}/bundle.json")
+        s3client.delete_object(
+            Bucket=html_bucket_name,
+            Key=f"{prefix}/bundle.json")
+        del updated["bundle"]
+    if updated != manifest:
+        write_manifest(prefix, updated)
+    return len([_ for _ in artifacts if updated[_] != manifest.get(_)]), len(artifacts)
 
 
 def get_highest_day(year: int) -> int:
@@ -111,57 +411,162 @@ def get_highest_day(year: int) -> int:
     return math.min([25, now.day()])
 
 
-def generatelist(
+def compute_artifacts(
         *,
+        raw: str,
+        generation_date: datetime.datetime,
         boardid: str,
         year: str,
+        highest_day: int,
         namemap: dict,
-        sessionid: str,
         title: str,
         uuid: str,
         global_scores: dict,
-        nopoint_days: List[int]):
-    highest_day = get_highest_day(int(year))
-    logger.info(f"Reading data for {title}/{year} -> day {highest_day}")
-    scoredict, generation_date = get_scores(year, sessionid, boardid)
+        nopoint_days: List[int],
+        board_snapshot: BoardSnapshot = None,
+        metrics: Metrics = None) -> tuple:
+    """
+    Parse the raw leaderboard, compute the statistics and serialize all artifacts.
+
+    Args:
+        board_snapshot (BoardSnapshot, optional): Snapshot of raw, saves parsing it. Defaults to None.
+        metrics (Metrics, optional): Receives the parse, stats and serialize timers. Defaults to None.
+
+    Returns:
+        tuple: (LeaderBoard, map <artifact name> -> json string)
+    """
+    metrics = metrics or Metrics("board")
+    if board_snapshot is None:
+        with metrics.timer("parse"):
+            board_snapshot = BoardSnapshot.parse(raw)
     leaderboard = LeaderBoard(
         title=title,
-        score=scoredict,
+        snapshot=board_snapshot,
         year=year,
         highestday=highest_day,
         namemap=namemap,
         uuid=uuid,
         global_scores=global_scores,
-        nopoint_days=nopoint_days)
-    # leaderboard.update_global_scores()
-    leaderboard.post_process_stats()
+        nopoint_days=nopoint_days,
+        engine=stats_engine)
+    with metrics.timer("stats"):
+        leaderboard.update_global_scores()
+        leaderboard.post_process_stats(computed_boards.get((boardid, year)))
+    computed_boards.put((boardid, year), leaderboard)
     logger.info(f"Generated data for {leaderboard.title}-{leaderboard.year}")
     extravars = {
         "aoc_fetch": f"{generation_date.strftime('%Y-%m-%d %H:%M:%S')} [{generation_date.tzname()}]",
         "generated": f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-        "nopoints": nopoint_days
+        "nopoints": nopoint_days,
+        "bundle": bundle_mode
     }
     print(nopoint_days)
 
-    jse = jsextractor(leaderboard, extravars)
-    generation_params = {
-        "table-dailyposition": jse.daily_position,
-        "table-accumulated_score": jse.accumulated_score,
-        "table-time_to_complete": jse.time_to_complete,
-        "table-offset_from_winner": jse.offset_from_winner,
-        "table-accumulated_solve_time": jse.accumulated_solve_time,
-        "table-time_to_second_star": jse.time_to_second_star,
-        "table-score_diff": jse.score_diff,
-        "table-global_score": jse.global_score,
-        "table-tobii_score": jse.tobii_score,
-        "table-accumulated_position": jse.accumulated_position,
-        "graph-accumulated_position_graph": jse.accumulated_position_graph,
-        "graph-scorediff_graph": jse.scorediff_graph,
-        "graph-daily_position_graph": jse.daily_position_graph,
-        "var-config": jse.config
-    }
+    with metrics.timer("serialize"):
+        jse = jsextractor(leaderboard, extravars, table_format=table_format)
+        artifacts = jse.artifacts()
+    return leaderboard, artifacts
+
+
+async def generatelist_async(
+        *,
+        boardid: str,
+        year: str,
+        namemap: dict,
+        sessionid: str,
+        title: str,
+        uuid: str,
+        global_scores: dict,
+        nopoint_days: List[int],
+        fingerprint: str = None,
+        last_fetch: int = None,
+        stages: Stages,
+        metrics: Metrics = None) -> dict:
+    """
+    Generate and upload the artifacts of a board/year.
+    Fetching, computing and uploading are run as stages, so several boards can be in flight.
+
+    Args:
+        fingerprint (str, optional): Fingerprint of the last generation. If the inputs still
+        have this fingerprint nothing is computed or uploaded. Defaults to None.
+        last_fetch (int, optional): When the leaderboard was last fetched from AoC. Defaults to None.
+        stages (Stages): Executors for the stages.
+        metrics (Metrics, optional): Receives the timers and counters of the stages. If not
+        given, the metrics are emitted when the generation is done. Defaults to None.
+
+    Raises:
+        RateLimitExceeded: The leaderboard may not be fetched from AoC yet.
+
+    Returns:
+        dict: The generation record, fingerprint: of the inputs, fetched: when the data was
+        fetched from AoC (if it was in this generation) and, if the board was generated,
+        its activity (see BoardSnapshot.activity).
+    """
+    emit = metrics is None
+    metrics = metrics or Metrics("board", boardid=boardid, year=year)
+    try:
+        highest_day = get_highest_day(int(year))
+        logger.info(f"Reading data for {title}/{year} -> day {highest_day}")
+        raw, generation_date, source = await stages.run(
+            "fetch", metrics.timed("fetch", get_scores), year, sessionid, boardid, last_fetch)
+        metrics.set("source", source)
+        record = {"fetched": int(generation_date.timestamp())} if source == "aoc" else {}
+        metrics.count("fetched_bytes", len(raw.encode('utf-8')))
+        new_fingerprint = make_fingerprint(
+            raw,
+            title=title,
+            uuid=uuid,
+            highest_day=highest_day,
+            namemap=namemap,
+            nopoint_days=nopoint_days,
+            global_scores=global_scores.get('fingerprint'),
+            settings=[table_format, content_encoding, bundle_mode],
+            generator=GENERATOR_VERSION)
+        if new_fingerprint == fingerprint:
+            logger.info(f"No changes for {title}/{year}, skipping generation")
+            metrics.count("unchanged")
+            return {"fingerprint": new_fingerprint, **record}
+
+        board_snapshot = await stages.run("fetch", metrics.timed("snapshot", load_snapshot), boardid, year, raw)
+        metrics.count("snapshot_used", int(board_snapshot is not None))
+        leaderboard, artifacts = await stages.run(
+            "compute",
+            compute_artifacts,
+            raw=raw,
+            generation_date=generation_date,
+            boardid=boardid,
+            year=year,
+            highest_day=highest_day,
+            namemap=namemap,
+            title=title,
+            uuid=uuid,
+            global_scores=global_scores,
+            nopoint_days=nopoint_days,
+            board_snapshot=board_snapshot,
+            metrics=metrics)
+        uploaded, artifact_count = await stages.run(
+            "upload", metrics.timed("upload", generate_data), leaderboard, artifacts)
+        metrics.count("artifacts_uploaded", uploaded)
+        metrics.count("artifacts_skipped", artifact_count - uploaded)
+        if board_snapshot is None and len(raw) >= snapshot_min_size:
+            await stages.run("upload", metrics.timed("upload", save_snapshot), boardid, year, leaderboard.snapshot)
+        return {"fingerprint": new_fingerprint, **record, **leaderboard.snapshot.activity()}
+    finally:
+        if emit:
+            metrics.emit()
+
 
-    generate_data(leaderboard, generation_params)
+def generatelist(**kwargs) -> dict:
+    """
+    Synchronous generatelist_async, see there for the arguments.
+    """
+    async def run():
+        stages = Stages()
+        try:
+            return await generatelist_async(stages=stages, **kwargs)
+        finally:
+            stages.shutdown()
+    return asyncio.run(run())
 
 
 def get_config(filename):
@@ -0,0 +1,251 @@
+import datetime
+import logging
+import numpy as np
+
+logger = logging.getLogger("aoc")
+
+# Sorts after every real timestamp/score, marks "no value" in rank computations.
+MISSING = np.iinfo(np.int64).max
+
+
+def competition_ranks(values: np.ndarray) -> np.ndarray:
+    """
+    Compute the 0-based competition rank ("1224"-ranking) of every value
+    within its column, i.e. along the first (player) axis.
+
+    Args:
+        values (np.ndarray): Values to rank, players along axis 0.
+
+    Returns:
+        np.ndarray: Ranks with the same shape as values.
+    """
+    order = np.argsort(values, axis=0, kind='stable')
+    ordered = np.take_along_axis(values, order, axis=0)
+    index = np.arange(len(values)).reshape((-1,) + (1,) * (values.ndim - 1))
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[1:] = ordered[1:] != ordered[:-1]
+    firsts = np.maximum.accumulate(np.where(starts, index, 0), axis=0)
+    ranks = np.empty_like(firsts)
+    np.put_along_axis(ranks, order, firsts, axis=0)
+    return ranks
+
+
+def as_list(values: np.ndarray, mask: np.ndarray = None) -> list:
+    """
+    Convert values to nested lists of python ints, with None where mask is False.
+    """
+    values = values.astype(object)
+    if mask is not None:
+        values[~mask] = None
+    return values.tolist()
+
+
+class BoardColumns():
+    """
+    Statistics computed by the columnar engine.
+
+    stars maps a Star attribute name to a [player][day][star] list and
+    days maps a PlayerDay attribute name to a [player][day] list. Day 1 is
+    at index 0 and players are in LeaderBoard.players order.
+    """
+    def __init__(self, players: list, stars: dict, days: dict):
+        self.rows = {p: i for i, p in enumerate(players)}
+        self.stars = stars
+        self.days = days
+
+    def star_values(self, player, attr: str) -> list:
+        return self.stars[attr][self.rows[player]]
+
+    def day_values(self, player, attr: str) -> list:
+        return self.days[attr][self.rows[player]]
+
+
+class ColumnarStats():
+    """
+    Vectorized replacement for LeaderBoard.post_process_stats.
+
+    Completion times are loaded into a players x days x 2 array and all
+    statistics are computed with array operations. Player and board level
+    values (totalscore, position, topscore, ...) are written back to the
+    objects, per star values are only available through board.columns.
+
+    Given the same board computed from an earlier snapshot, only the days
+    from LeaderBoard.first_changed_day on are computed. The running values
+    continue from the last reused day and the columns of the reused days
+    are taken over.
+    """
+    def __init__(self, board):
+        self.board = board
+
+    def load(self, firstday: int = 1):
+        """
+        Completion times of the days from firstday on, and where they are set.
+        """
+        board = self.board
+        shape = (len(board.players), board.highestday - firstday + 1, 2)
+        times = np.zeros(shape, dtype=np.int64)
+        done = np.zeros(shape, dtype=bool)
+        for i, player in enumerate(board.players):
+            for day, playerday in player.days.items():
+                if day < firstday or day > board.highestday:
+                    continue
+                for star in range(2):
+                    completiontime = playerday[star].completiontime
+                    if completiontime is not None:
+                        times[i, day-firstday, star] = completiontime
+                        done[i, day-firstday, star] = True
+        return times, done
+
+    def reused(self, previous, firstday: int) -> dict:
+        """
+        The running values of the players after the last reused day (firstday - 1)
+        and which of their stars of the reused days are completed.
+
+        Returns:
+            dict: map <name> -> array in board.players order, "rows" the row of each player in previous.columns.
+        """
+        columns = previous.columns
+        old_players = {_.id: _ for _ in previous.players}
+        rows = [columns.rows[old_players[_.id]] for _ in self.board.players]
+        last = firstday - 2
+        accumulatedtime = [columns.stars['accumulatedtimetocomplete'][_][last][1] for _ in rows]
+        return {
+            'rows': rows,
+            'accumulatedscore': np.array([columns.stars['accumulatedscore'][_][last][1] for _ in rows]),
+            'accumulatedtobiiscore': np.array([columns.stars['accumulatedtobiiscore'][_][last][1] for _ in rows]),
+            # Whether the chain of second stars is unbroken up to the last reused day, and its accumulated time.
+            'chain': np.array([_ is not None for _ in accumulatedtime]),
+            'accumulatedtime': np.array([_ or 0 for _ in accumulatedtime], dtype=np.int64),
+            'done': np.array(
+                [[[_ is not None for _ in stars] for stars in columns.stars['completiontime'][row][:firstday - 1]]
+                 for row in rows],
+                dtype=bool).reshape(len(rows), firstday - 1, 2),
+        }
+
+    def run(self, previous=None) -> BoardColumns:
+        board = self.board
+        players = board.players
+        logger.info("Post processing (columnar)")
+        if not players:
+            return BoardColumns(players, {}, {})
+
+        if board.excludezero:
+            player_count = len([_ for _ in players if _.stars > 0])
+        else:
+            player_count = len(players)
+        player_total = len(players)
+        # The last day is always computed, the player and board totals are taken from it.
+        firstday = max(1, min(board.first_changed_day(previous), board.highestday))
+        days = board.highestday - firstday + 1
+        reused = None
+        if firstday > 1:
+            logger.info(f"Reusing statistics for day 1-{firstday-1}")
+            reused = self.reused(previous, firstday)
+            for day in range(1, firstday):
+                board.days[day] = previous.days[day]
+
+        times, done = self.load(firstday)
+        publish_times = np.array(
+            [int(datetime.datetime(year=int(board.year), month=12, day=day, hour=6).timestamp())
+             for day in range(firstday, board.highestday + 1)],
+            dtype=np.int64)
+        scoring = np.array([not board.day_excluded(day) for day in range(firstday, board.highestday + 1)])
+
+        timespan = times - publish_times[None, :, None]
+
+        # The accumulated time requires an unbroken chain of second stars on the previous days.
+        star2span = np.where(done[:, :, 1], timespan[:, :, 1], 0)
+        previous_time = np.cumsum(star2span, axis=1) - star2span
+        chain = np.ones((player_total, days), dtype=bool)
+        chain[:, 1:] = np.logical_and.accumulate(done[:, :-1, 1], axis=1)
+        if reused is not None:
+            previous_time += reused['accumulatedtime'][:, None]
+            chain &= reused['chain'][:, None]
+        accumulatedtime = previous_time[:, :, None] + timespan
+        has_accumulatedtime = done & chain[:, :, None]
+
+        besttime = np.where(has_accumulatedtime, timespan, MISSING).min(axis=0)
+        has_besttime = besttime != MISSING
+        has_offset = done & has_besttime[None]
+        offsetfromwinner = timespan - np.where(has_besttime, besttime, 0)[None]
+
+        index = competition_ranks(np.where(done, times, MISSING))
+        counted = done & scoring[None, :, None]
+        gain = np.where(counted, player_count - index, 0)
+        tobiigain = np.where(scoring[None, :, None], np.where(done, index, player_total), 0)
+        accumulatedscore = np.cumsum(gain.reshape(player_total, -1), axis=1).reshape(times.shape)
+        accumulatedtobiiscore = np.cumsum(tobiigain.reshape(player_total, -1), axis=1).reshape(times.shape)
+        if reused is not None:
+            accumulatedscore += reused['accumulatedscore'][:, None, None]
+            accumulatedtobiiscore += reused['accumulatedtobiiscore'][:, None, None]
+
+        placed = accumulatedscore > 0
+        accumulatedposition = np.where(
+            placed,
+            competition_ranks(np.where(placed, -accumulatedscore, MISSING)),
+            -1)
+
+        both = done.all(axis=2)
+        timetocompletestar2 = times[:, :, 1] - times[:, :, 0]
+        star2pos = self.star2_positions(np.where(both, timetocompletestar2, MISSING), both)
+
+        starsawarded = np.array(
+            [[board.days[day][star].starsawarded for star in range(2)] for day in range(1, board.highestday + 1)],
+            dtype=np.int64)
+        alldone = done if reused is None else np.concatenate([reused['done'], done], axis=1)
+        pendingpoints = np.where(alldone, 0, player_count - starsawarded[None]).sum(axis=(1, 2))
+
+        topscore = accumulatedscore.max(axis=0)
+        for day in range(firstday, board.highestday + 1):
+            for star in range(2):
+                boardstar = board.days[day][star]
+                boardstar.topscore = int(topscore[day-firstday, star])
+                if has_besttime[day-firstday, star]:
+                    boardstar.besttime = int(besttime[day-firstday, star])
+
+        finalscore = accumulatedscore[:, -1, 1]
+        totalscore = finalscore.tolist()
+        tobiitotal = accumulatedtobiiscore[:, -1, 1].tolist()
+        pending = pendingpoints.tolist()
+        position = np.empty(player_total, dtype=np.int64)
+        position[np.argsort(-finalscore, kind='stable')] = np.arange(1, player_total + 1)
+        for i, player in enumerate(players):
+            player.totalscore = totalscore[i]
+            player.localscore = totalscore[i]
+            player.accumulatedtobiiscoretotal = tobiitotal[i]
+            player.pendingpoints += pending[i]
+            player.position = int(position[i])
+
+        stars = {
+            'completiontime': as_list(times, done),
+            'timetocomplete': as_list(timespan, done),
+            'accumulatedtimetocomplete': as_list(accumulatedtime, has_accumulatedtime),
+            'offsetfromwinner': as_list(offsetfromwinner, has_offset),
+            'position': as_list(index + 1, done),
+            'accumulatedscore': as_list(accumulatedscore),
+            'accumulatedtobiiscore': as_list(accumulatedtobiiscore),
+            'accumulatedposition': as_list(accumulatedposition),
+        }
+        playerdays = {
+            'timetocompletestar2': as_list(timetocompletestar2, both),
+            'star2pos': as_list(star2pos),
+        }
+        if reused is not None:
+            for values, old in [(stars, previous.columns.stars), (playerdays, previous.columns.days)]:
+                for attr, rows in values.items():
+                    values[attr] = [old[attr][row][:firstday - 1] + new for row, new in zip(reused['rows'], rows)]
+        return BoardColumns(players, stars, playerdays)
+
+    def star2_positions(self, values: np.ndarray, both: np.ndarray) -> np.ndarray:
+        """
+        Position on time between the stars. A player tied with the one
+        just ahead gets that player's index (not position), players without
+        both stars are placed last.
+        """
+        order = np.argsort(values, axis=0, kind='stable')
+        ordered = np.take_along_axis(values, order, axis=0)
+        positions = np.arange(1, len(values) + 1)[:, None].repeat(values.shape[1], axis=1)
+        positions[1:] -= ordered[1:] == ordered[:-1]
+        result = np.empty_like(positions)
+        np.put_along_axis(result, order, positions, axis=0)
+        return np.where(both, result, len(values) + 1)
@@ -313,15 +313,84 @@ function updateTimeFetched(datakey, firstTime) {
   }
 }
 
+// Artifacts of the board (name -> bytes) when it is published as a bundle.
+// var-config announces the bundle, it is never read from the bundle.
+var bundle;
+
+// A bundle is a json header line {"version": 1, "artifacts": {name: [start, end]}}
+// followed by all artifacts, offsets are in bytes from the start of the second line.
+function loadBundle() {
+  return fetch(makeUrl("bundle"))
+    .then(response => {
+      if (!response.ok) {
+        throw Error(`No bundle (${response.status})`);
+      }
+      return response.arrayBuffer();
+    })
+    .then(buffer => {
+      const bytes = new Uint8Array(buffer);
+      const newline = bytes.indexOf(10);
+      const header = JSON.parse(new TextDecoder().decode(bytes.subarray(0, newline)));
+      const artifacts = {};
+      for (const name in header.artifacts) {
+        const [start, end] = header.artifacts[name];
+        artifacts[name] = bytes.subarray(newline + 1 + start, newline + 1 + end);
+      }
+      bundle = artifacts;
+    });
+}
+
+// Read an artifact from the bundle if there is one, otherwise from its own file.
+// refresh reloads the bundle from the server first.
+function fetchArtifact(name, refresh) {
+  if (bundle) {
+    const loaded = refresh ? loadBundle() : Promise.resolve();
+    return loaded.then(() => JSON.parse(new TextDecoder().decode(bundle[name])));
+  }
+  return fetch(makeUrl(name)).then(response => response.json());
+}
+
+// Format of the table artifacts, announced in var-config. Version 1 if not announced.
+var tableFormat = 1;
+
+// Version 2 tables are published under their own names, see tableFormat.
+function tableName(name) {
+  return tableFormat == 1 ? name : `${name}.v${tableFormat}`;
+}
+
+// Expand a table artifact into ag-grid rows.
+// Version 2 tables are stored column by column, mostly empty columns
+// as {i: [row indices], v: [values]}. Older artifacts are lists of rows.
+function expandTable(data) {
+  if (Array.isArray(data)) {
+    return data;
+  }
+
+  const rows = [];
+  for (let row = 0; row < data.rows; row++) {
+    rows.push({});
+  }
+  data.columns.forEach((key, index) => {
+    let column = data.values[index];
+    if (!Array.isArray(column)) {
+      const dense = new Array(data.rows).fill(null);
+      column.i.forEach((row, i) => { dense[row] = column.v[i]; });
+      column = dense;
+    }
+    for (let row = 0; row < data.rows; row++) {
+      rows[row][key] = column[row];
+    }
+  });
+  return rows;
+}
+
 function fetchTableData(datakey, config, opts) {
   console.log("loading data for ", datakey);
 
   const widgetConfig = config[datakey];
-  const url = makeUrl(widgetConfig.dataname);
   const api = widgetConfig.opts.api;
-  return fetch(url)
-    .then(response => response.json())
-    .then(data => api.setRowData(data))
+  return fetchArtifact(tableName(widgetConfig.dataname), !opts.firstTime)
+    .then(data => api.setRowData(expandTable(data)))
     .then(() => {
       const filterInstance = api.getFilterInstance("T");
       filterInstance.setModel({
@@ -377,10 +446,8 @@ function openTab(target, tabName, config) {
 
     widgetPromise = fetchTableData(datakey, config, {firstTime: true});
   } else if (datatype == "chart") {
-    const url = makeUrl(widgetConfig.dataname);
-    console.log(`${datakey} <- ${url}`);
-    widgetPromise = fetch(url)
-      .then(response => response.json())
+    console.log(`${datakey} <- ${widgetConfig.dataname}`);
+    widgetPromise = fetchArtifact(widgetConfig.dataname)
       .then(data => drawChart(
         `chart${datakey}`,
         data,
@@ -667,13 +734,21 @@ function markNoPointColumns(nopoints) {
 window.onload = function() {
   handleParams();
 
-  fetch(makeUrl("var-config"))
-    .then(response => response.json())
+  fetchArtifact("var-config")
+    .then(data => {
+        if (!data.extravars.bundle) {
+          return data;
+        }
+        return loadBundle()
+          .catch(err => console.log("Using separate files.", err))
+          .then(() => data);
+      })
     .then(data => {
         document.title = `${data["title"]} - ${year}`;
         all_players = data["all_players"];
         medals_best_times = data["medals_best_time"];
         medals_star2 = data["medals_star2"];
+        tableFormat = data.table_format || 1;
         charts.aocFetchTime = data.extravars.aoc_fetch;
         charts.generatedTime = data.extravars.generated;
         markNoPointColumns(data.extravars.nopoints);
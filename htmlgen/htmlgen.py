@@ -1,10 +1,23 @@
 import os
 import json
+import hashlib
 import boto3
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from aochttp import RateLimitExceeded
 import aocgen
+import asyncio
+import scoreboard
+from pipeline import Stages
+import metrics
+import profiling
+import scheduling
+import s3cache
+from aochttp import client
 import logging
 import datetime
+import multiprocessing
+import multiprocessing.connection
 import pytz
 from typing import List
 
@@ -18,6 +31,19 @@ timestamps_table_name = os.environ.get("DDB_TIMESTAMPS", "scoreboard-timestamps"
 timestamps_table = boto3.resource('dynamodb').Table(timestamps_table_name)
 
 
+# Max number of messages in a batch that are generated at the same time (1: one after another).
+generator_workers = int(os.environ.get("GENERATOR_WORKERS", "4"))
+# "async": overlapping stages in one process, "sequential": one message after another,
+# "process": one process per message (see process_in_parallel), which does not keep
+# what the caches learn between invocations.
+generator_mode = os.environ.get("GENERATOR_MODE", "async")
+# The queue this function consumes, "hot" or "cold" (see spawner.lane).
+generator_lane = os.environ.get("GENERATOR_LANE", "hot")
+# Messages of boards that may not be fetched from AoC yet are sent back to this queue (the queue of the lane).
+requeue_queue_name = os.environ.get("SQS_GENERATOR", "scoreboard-generator_queue")
+# SQS does not delay messages longer than this.
+MAX_DELAY_SECONDS = 900
+
 COL_LISTSIZE = 'listsize'
 COL_ID = 'year'
 COL_DAY = 'day'
@@ -29,33 +55,172 @@ logging.basicConfig(level=logging.INFO)
 global_scores = {}
 
 
-def handle_record(
+async def handle_record_async(
         *,
         boardid: str,
         year: str,
-        namemap: dict,
         sessionid: str,
         title: str,
         uuid: str,
-        nopoint_days: List[int]):
+        nopoint_days: List[int],
+        stages: Stages,
+        namemap: dict = None) -> int:
+    """
+    Generate a board/year and store its generation record.
+
+    The namemap of the board is read from the namemap table unless given.
 
+    Returns:
+        int: 0, or the seconds to wait before the board may be fetched from AoC (see RateLimitExceeded).
+    """
     print(f"Generating html for {title} ({boardid}) -- {year}.")
+    board_metrics = metrics.Metrics("board", boardid=boardid, year=year)
     tz = pytz.timezone('America/New_York')
     now = datetime.datetime.now(tz=tz).timestamp()
-    timestamps_table.put_item(Item={
-        "id": f"{year}|{boardid}",
+    key = f"{year}|{boardid}"
+    item = {
+        "id": key,
         "lastgen": int(now)
-    })
+    }
+
+    previous = {}
+    generation = {}
+    try:
+        if namemap is None:
+            namemap = await stages.run("read", board_metrics.timed("read", get_namemap), boardid)
+        previous = await stages.run("read", board_metrics.timed("read", timestamps_table.get_item), Key={"id": key})
+        previous = previous.get('Item', {})
+        if "lastfetch" in previous:
+            item["lastfetch"] = int(previous["lastfetch"])
+        try:
+            await stages.run(
+                "read", board_metrics.timed("write", claim), key=key, year=year, now=int(now), previous=previous)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+            # The board is generated by the invocation holding the claim, drop the message.
+            logging.info(f"{key} is generated by another invocation")
+            board_metrics.count("claimed")
+            return 0
+
+        generate = aocgen.generatelist_async
+        if profiling.should_profile(boardid):
+            generate = profiling.profiled(generate, f"{boardid}_{year}")
+            board_metrics.count("profiled")
+
+        # The fingerprint is only stored when the generation succeeded (or could not fetch yet).
+        delay = 0
+        try:
+            generation = await generate(
+                boardid=boardid,
+                year=year,
+                namemap=namemap,
+                sessionid=sessionid,
+                title=title,
+                uuid=uuid,
+                global_scores=global_scores[year],
+                nopoint_days=nopoint_days,
+                fingerprint=previous.get("fingerprint"),
+                last_fetch=item.get("lastfetch"),
+                stages=stages,
+                metrics=board_metrics)
+            item["fingerprint"] = generation["fingerprint"]
+            if "fetched" in generation:
+                item["lastfetch"] = generation["fetched"]
+        except RateLimitExceeded as e:
+            delay = int(e.retry_after) + 1
+            logging.info(f"{key} may not be fetched from AoC yet, retry in {delay}s: {e}")
+            board_metrics.count("deferred")
+            if "fingerprint" in previous:
+                item["fingerprint"] = previous["fingerprint"]
+        finally:
+            item.update(schedule(year=year, now=int(now), previous=previous, generation=generation))
+            await stages.run("read", board_metrics.timed("write", timestamps_table.put_item), Item=item)
+        return delay
+    except Exception:
+        board_metrics.count("errors")
+        raise
+    finally:
+        board_metrics.emit()
+
+
+def claim(*, key: str, year: str, now: int, previous: dict) -> None:
+    """
+    Record in the timestamps item that the board/year is being generated, before generating it.
+    lastgen is set to now (a concurrent generation of the board fails its claim) and next_due
+    to the retry of a failed generation (the spawner does not send it meanwhile).
+
+    Args:
+        key (str): Id of the timestamps item.
+        previous (dict): The timestamps item as read before, empty if there is none.
+
+    Raises:
+        ClientError: ConditionalCheckFailedException if another generation claimed it since previous was read.
+    """
+    due = scheduling.next_due(year=year, last_fetch=now)
+    values = {":now": now, ":due": due, ":bucket": scheduling.due_bucket(due)}
+    if "lastgen" in previous:
+        condition = "lastgen = :previous"
+        values[":previous"] = previous["lastgen"]
+    else:
+        condition = "attribute_not_exists(lastgen)"
+    timestamps_table.update_item(
+        Key={"id": key},
+        UpdateExpression="SET lastgen = :now, next_due = :due, due_bucket = :bucket",
+        ConditionExpression=condition,
+        ExpressionAttributeValues=values)
 
-    aocgen.generatelist(
-        boardid=boardid,
-        year=year,
-        namemap=namemap,
-        sessionid=sessionid,
-        title=title,
-        uuid=uuid,
-        global_scores=global_scores[year],
-        nopoint_days=nopoint_days)
+
+def schedule(*, year: str, now: int, previous: dict, generation: dict) -> dict:
+    """
+    Compute the activity attributes of the timestamps item of a board/year and when it is due again.
+
+    Args:
+        year (str): Year of the board.
+        now (int): Timestamp of the generation.
+        previous (dict): The timestamps item of the generation before, empty if there is none.
+        generation (dict): Returned by aocgen.generatelist_async, empty if the generation failed.
+
+    Returns:
+        dict: last_star and stars (if known), next_due and due_bucket (the partition of the due index).
+    """
+    record = {_: int(previous[_]) for _ in ["last_star", "stars"] if _ in previous}
+    if "fingerprint" not in generation:
+        # Failed, retry as soon as the cache allows.
+        record["next_due"] = scheduling.next_due(year=year, last_fetch=now)
+    else:
+        gained = 0
+        if "stars" in generation:
+            gained = max(0, generation["stars"] - record.get("stars", generation["stars"]))
+            record.update(last_star=generation["last_star"], stars=generation["stars"])
+        record["next_due"] = scheduling.next_due(
+            year=year,
+            last_fetch=now,
+            last_star=record.get("last_star"),
+            stars_gained=gained)
+    record["due_bucket"] = scheduling.due_bucket(record["next_due"])
+    return record
+
+
+def handle_record(*, namemap: dict = None, **kwargs) -> int:
+    """
+    Synchronous handle_record_async, see there for the arguments.
+    """
+    async def run():
+        stages = Stages()
+        try:
+            return await handle_record_async(stages=stages, namemap=namemap, **kwargs)
+        finally:
+            stages.shutdown()
+    return asyncio.run(run())
+
+
+def requeue(message, delay: int) -> None:
+    """
+    Send message back to the queue of the lane, to be handled after delay seconds.
+    """
+    queue = boto3.resource('sqs').get_queue_by_name(QueueName=requeue_queue_name)
+    queue.send_message(MessageBody=message['body'], DelaySeconds=min(delay, MAX_DELAY_SECONDS))
 
 
 def get_namemap(boardid: str) -> dict:
@@ -79,7 +244,11 @@ def get_global_scores(years: set):
             scores[int(item[COL_DAY])] = item[COL_RESULTS]
             for _ in item[COL_RESULTS]:
                 names.update(_)
-        global_scores[year] = {'scores': scores, 'names': names}
+        global_scores[year] = {
+            'scores': scores,
+            'names': names,
+            'index': scoreboard.global_score_index(scores),
+            'fingerprint': hashlib.md5(json.dumps(scores, sort_keys=True, default=str).encode('utf-8')).hexdigest()}
         logging.debug(f"Loaded global data for {year}")
 
 
@@ -88,27 +257,140 @@ def process_messages(messages):
         logging.warning("No records detected")
         return
 
+    invocation_metrics = metrics.Metrics("invocation", mode=generator_mode, lane=generator_lane)
+    invocation_metrics.count("messages", len(messages))
     years = {json.loads(msg['body'])['year'] for msg in messages}
-    get_global_scores(years)
+    with invocation_metrics.timer("global_scores"):
+        get_global_scores(years)
 
-    for message in messages:
-        try:
-            msg = json.loads(message['body'])
-            handle_record(
-                boardid=msg['boardid'],
-                year=msg['year'],
-                namemap=get_namemap(msg['boardid']),
-                sessionid=msg['sessionid'],
-                title=msg['title'],
-                uuid=msg['uuid'],
-                nopoint_days=msg.get('nopoint_days', []))
-        except Exception as e:
-            logging.exception(e)
+    mode = generator_mode
+    if mode == "async" and profiling.enabled():
+        # cProfile and tracemalloc would see the work of all boards in flight.
+        logging.warning("Profiling is enabled, generating the boards one after another")
+        mode = "sequential"
+
+    try:
+        if mode == "async":
+            asyncio.run(process_messages_async(messages))
+        elif mode == "process" and generator_workers > 1 and len(messages) > 1:
+            process_in_parallel(messages, generator_workers)
+            return
+        else:
+            invocation_metrics.set("mode", "sequential")
+            for message in messages:
+                handle_message(message)
+        log_cache_stats()
+    finally:
+        invocation_metrics.emit()
+
+
+def log_cache_stats() -> None:
+    logging.info(f"Datacache hits/misses: {aocgen.data_cache.stats}")
+
+
+def record_arguments(message) -> dict:
+    msg = json.loads(message['body'])
+    return {
+        "boardid": msg['boardid'],
+        "year": msg['year'],
+        "sessionid": msg['sessionid'],
+        "title": msg['title'],
+        "uuid": msg['uuid'],
+        "nopoint_days": msg.get('nopoint_days', [])}
+
+
+def handle_message(message) -> None:
+    try:
+        delay = handle_record(**record_arguments(message))
+        if delay:
+            requeue(message, delay)
+    except Exception as e:
+        logging.exception(e)
+
+
+async def process_messages_async(messages) -> None:
+    """
+    Handle the messages concurrently in one event loop, see pipeline.Stages.
+    At most generator_workers boards are in flight at the same time.
+    """
+    async def handle(message):
+        async with boards:
+            try:
+                delay = await handle_record_async(stages=stages, **record_arguments(message))
+                if delay:
+                    await stages.run("read", requeue, message, delay)
+            except Exception as e:
+                logging.exception(e)
+
+    boards = asyncio.Semaphore(max(1, generator_workers))
+    stages = Stages()
+    try:
+        await asyncio.gather(*[handle(message) for message in messages])
+    finally:
+        stages.shutdown()
+
+
+def reset_clients() -> None:
+    """
+    Replace the AWS clients and the AoC connection pool a forked worker inherited from its parent.
+    They keep sockets alive, which the parent and the other workers would be using as well.
+    """
+    global namemap_table, globalscores_table, timestamps_table
+    boto3.setup_default_session()
+    dynamodb = boto3.resource('dynamodb')
+    namemap_table = dynamodb.Table(namemap_table_name)
+    globalscores_table = dynamodb.Table(globalscores_table_name)
+    timestamps_table = dynamodb.Table(timestamps_table_name)
+    aocgen.s3client = s3cache.s3client = profiling.s3client = boto3.client('s3')
+    aocgen.html_bucket = boto3.resource('s3').Bucket(aocgen.html_bucket_name)
+    client.reset()
+
+
+def handle_message_in_worker(message) -> None:
+    reset_clients()
+    handle_message(message)
+    log_cache_stats()
+
+
+def process_in_parallel(messages, workers: int) -> None:
+    """
+    Handle each message in a process of its own, at most <workers> at the same time.
+    The artifacts of each board are still uploaded by threads in that process.
+
+    multiprocessing.Pool (and ProcessPoolExecutor) need /dev/shm, which lambda
+    does not provide, so plain Processes are started and waited for instead.
+    The global scores are loaded before forking and are shared with the workers,
+    the AWS clients and AoC connections are created again in each worker.
+    Each worker logs its own datacache statistics.
+
+    Whatever a worker adds to the process wide state (the RAM tier of the
+    datacache, the computed boards of aocgen) is lost when it exits, every
+    invocation starts from the state of the parent.
+
+    Args:
+        messages (list): SQS messages
+        workers (int): Max number of concurrent processes
+    """
+    pending = list(messages)
+    running = {}
+    while pending or running:
+        while pending and len(running) < workers:
+            message = pending.pop(0)
+            process = multiprocessing.Process(target=handle_message_in_worker, args=(message,))
+            process.start()
+            running[process.sentinel] = (process, message)
+
+        for sentinel in multiprocessing.connection.wait(list(running)):
+            process, message = running.pop(sentinel)
+            process.join()
+            if process.exitcode != 0:
+                logging.error(f"Worker for message {message.get('messageId')} exited with {process.exitcode}")
 
 
 def main(event, context):
     try:
         messages = event.get('Records', [])
+        metrics.invocation_id = getattr(context, 'aws_request_id', None)
         # print(messages)
         process_messages(messages)
     except Exception as e:
@@ -1,18 +1,81 @@
 import json
 import re
 import logging
-from collections import defaultdict
 from scoreboard import LeaderBoard
 
 logger = logging.getLogger("aoc")
 
+# Two star tables: name -> (column, valueextractor)
+TWO_STAR_TABLES = {
+    "table-dailyposition": ('position', None),
+    "table-accumulated_score": ('accumulatedscore', None),
+    "table-time_to_complete": ('timetocomplete', None),
+    "table-offset_from_winner": ('offsetfromwinner', None),
+    "table-accumulated_solve_time": ('accumulatedtimetocomplete', None),
+    "table-global_score": ('globalscore', None),
+    "table-tobii_score": ('accumulatedtobiiscore', None),
+    "table-accumulated_position": ('accumulatedposition', lambda value: value + 1),
+}
+
+
+def table_columns(rows: list) -> dict:
+    """
+    Convert a table (rows with the same keys) to table format version 2:
+    {"version": 2, "rows": <n>, "columns": [<key>, ...], "values": [<column>, ...]}
+
+    A column where most values are null is stored sparse as {"i": [<row>, ...], "v": [<value>, ...]}.
+
+    Args:
+        rows (list): Table rows, as dictionaries.
+
+    Returns:
+        dict: The table column by column.
+    """
+    columns = list(rows[0]) if rows else []
+    values = []
+    for key in columns:
+        column = [row[key] for row in rows]
+        present = [i for i, value in enumerate(column) if value is not None]
+        if len(present) * 2 < len(column):
+            values.append({"i": present, "v": [column[i] for i in present]})
+        else:
+            values.append(column)
+    return {"version": 2, "rows": len(rows), "columns": columns, "values": values}
+
+
+def medals(results: list) -> dict:
+    """
+    Award medals 1-3 to the three best (lowest) values, ties share the medal.
+
+    Args:
+        results (list): (value, tiebreak, row) for each player with a value.
+
+    Returns:
+        dict: map <row> -> medal
+    """
+    data = {}
+    medal = 0
+    last = None
+    for value, _, row in sorted(results):
+        if medal == 0 or value != last:
+            medal += 1
+            last = value
+        if medal > 3:
+            break
+        data[row] = medal
+    return data
+
 
 class jsextractor():
-    def __init__(self, board: LeaderBoard, extravars: dict):
+    def __init__(self, board: LeaderBoard, extravars: dict, *, table_format: int = 1):
         self.indent = {}
         # self.indent = {"indent": 3}
         self.board = board
         self.extravars = extravars
+        # 1: list of rows, 2: column-wise (see table_columns)
+        self.table_format = table_format
+        # The ordering is fixed once the statistics are computed, sort it only once.
+        self.ordered_players = board.ordered_players
 
     def _make_return_value(self, data, *, make_tokens: bool = False) -> str:
         """
@@ -32,90 +95,163 @@ class jsextractor():
             return self.string_to_tokens(s)
         return s
 
-    def get_padding(self, list_size) -> int:
-        if list_size < 10:
-            return 1
-        if list_size < 100:
-            return 2
-        return 3
+    def artifacts(self) -> dict:
+        """
+        Generate all tables, graphs and the config walking the ordered players once.
 
-    def config(self) -> str:
-        data = {
-            'all_players': [_.name for _ in self.board.ordered_players if _.totalscore > 0],
-            'medals_best_time': self._medals_best_time(),
-            'medals_star2': self._medals_star2(),
+        Returns:
+            dict: map <artifact name> -> json string
+        """
+        days = range(1, self.board.highestday+1)
+        keys = [(f"d{d}_{star}", d-1, star) for d in days for star in range(2)]
+        topscores = [[self.board.days[d][star].topscore for star in range(2)] for d in days]
+        boardindex = {p: i for i, p in enumerate(self.board.players)}
+
+        tables = {name: [] for name in TWO_STAR_TABLES}
+        score_diff = []
+        time_to_second_star = []
+        graphs = {
+            name: [[((d-1) * 2 + star + 1) / 2.0] for d in days for star in range(2)]
+            for name in ["graph-accumulated_position_graph", "graph-scorediff_graph", "graph-daily_position_graph"]}
+        all_players = []
+        offsets = [[[], []] for d in days]
+        times = [[] for d in days]
+
+        for row, p in enumerate(self.ordered_players):
+            common = self.common_columns(row + 1, p)
+            values = {}
+            for name, (column, valueextractor) in TWO_STAR_TABLES.items():
+                values[column] = self.board.star_values(p, column)
+                player_data = dict(common)
+                for key, d, star in keys:
+                    value = values[column][d][star]
+                    player_data[key] = valueextractor(value) if valueextractor else value
+                tables[name].append(player_data)
+
+            player_data = dict(common)
+            for key, d, star in keys:
+                player_data[key] = topscores[d][star] - values['accumulatedscore'][d][star]
+            score_diff.append(player_data)
+
+            player_data = dict(common)
+            star2times = self.board.day_values(p, 'timetocompletestar2')
+            for d in days:
+                player_data[f"d{d}"] = star2times[d-1]
+                if star2times[d-1] is not None:
+                    times[d-1].append((star2times[d-1], boardindex[p], row))
+            time_to_second_star.append(player_data)
+
+            for _, d, star in keys:
+                offset = values['offsetfromwinner'][d][star]
+                if offset is not None:
+                    offsets[d][star].append((offset, boardindex[p], row))
+
+            if p.totalscore > 0:
+                all_players.append(p.name)
+                for i, (_, d, star) in enumerate(keys):
+                    graphs["graph-accumulated_position_graph"][i].append(values['accumulatedposition'][d][star] + 1)
+                    graphs["graph-scorediff_graph"][i].append(
+                        topscores[d][star] - values['accumulatedscore'][d][star])
+                    graphs["graph-daily_position_graph"][i].append(values['position'][d][star])
+
+        config = {
+            'all_players': all_players,
+            'medals_best_time': {
+                d*2 + star: medals(offsets[d-1][star]) for star in range(2) for d in days if offsets[d-1][star]},
+            'medals_star2': {d: medals(times[d-1]) for d in days if times[d-1]},
             'title': self.board.title,
             'extravars': self.extravars
         }
-        return self._make_return_value(data)
 
-    def _medals_best_time(self) -> dict:
-        data = defaultdict(dict)
-        for star in range(2):
-            for d in range(1, self.board.highestday+1):
-                results = defaultdict(list)
-                for p in self.board.players:
-                    offset = p[d][star].offsetfromwinner
-                    if offset is not None:
-                        results[p[d][star].offsetfromwinner].append(p)
-
-                for i, res in enumerate(sorted(results)[:3], start=1):
-                    for p in results[res]:
-                        data[d*2 + star][self.board.ordered_players.index(p)] = i
-        return data
-
-    def _medals_star2(self) -> dict:
-        data = defaultdict(dict)
-        for d in range(1, self.board.highestday+1):
-            results = defaultdict(list)
-            for p in self.board.players:
-                if p[d].timetocompletestar2 is not None:
-                    results[p[d].timetocompletestar2].append(p)
-
-            for i, res in enumerate(sorted(results)[:3], start=1):
-                for p in results[res]:
-                    data[d][self.board.ordered_players.index(p)] = i
-        return data
-
-    def all_players(self) -> str:
-        data = [_.name for _ in self.board.ordered_players if _.totalscore > 0]
-        return self._make_return_value(data)
+        if self.table_format != 1:
+            config['table_format'] = self.table_format
 
-    def scorediff_graph(self) -> str:
-        data = []
-        for day in range(1, self.board.highestday+1):
-            for star in range(2):
-                playerdata = [((day-1) * 2 + star + 1) / 2.0]
-                for p in [_ for _ in self.board.ordered_players if _.totalscore > 0]:
-                    playerdata.append(self.board.days[day][star].topscore - p[day][star].accumulatedscore)
-                data.append(playerdata)
+        tables["table-time_to_second_star"] = time_to_second_star
+        tables["table-score_diff"] = score_diff
+        # Version 1 tables are written in any format, for pages cached before the format changed.
+        result = {name: self._make_return_value(data) for name, data in tables.items()}
+        if self.table_format != 1:
+            result.update({self.table_name(name): self._make_table_value(data) for name, data in tables.items()})
+        result.update({name: self._make_return_value(data) for name, data in graphs.items()})
+        result["var-config"] = self._make_return_value(config)
+        return result
 
-        return self._make_return_value(data)
+    def table_name(self, name: str) -> str:
+        """
+        The artifact name of table name in the configured table format.
+        Version 1 tables keep their names, pages that only read version 1 never see another format.
+        """
+        if self.table_format == 1:
+            return name
+        return f"{name}.v{self.table_format}"
+
+    def _make_table_value(self, rows: list) -> str:
+        """
+        Convert the rows of a table to json in the configured table format.
+        """
+        if self.table_format == 1:
+            return self._make_return_value(rows)
+        return json.dumps(table_columns(rows), separators=(',', ':'), **self.indent)
+
+    def artifact(self, name: str) -> str:
+        """
+        A single artifact of artifacts(), tables in the configured table format.
+        All artifacts are generated, call artifacts() to get more than one.
+        """
+        artifacts = self.artifacts()
+        return artifacts[self.table_name(name) if name.startswith("table-") else name]
+
+    def config(self) -> str:
+        return self.artifact("var-config")
+
+    def daily_position(self) -> str:
+        return self.artifact("table-dailyposition")
+
+    def accumulated_score(self) -> str:
+        return self.artifact("table-accumulated_score")
+
+    def time_to_complete(self) -> str:
+        return self.artifact("table-time_to_complete")
+
+    def offset_from_winner(self) -> str:
+        return self.artifact("table-offset_from_winner")
+
+    def accumulated_solve_time(self) -> str:
+        return self.artifact("table-accumulated_solve_time")
+
+    def time_to_second_star(self) -> str:
+        return self.artifact("table-time_to_second_star")
+
+    def score_diff(self) -> str:
+        return self.artifact("table-score_diff")
+
+    def global_score(self) -> str:
+        return self.artifact("table-global_score")
+
+    def tobii_score(self) -> str:
+        return self.artifact("table-tobii_score")
+
+    def accumulated_position(self) -> str:
+        return self.artifact("table-accumulated_position")
 
     def accumulated_position_graph(self) -> str:
-        data = []
-        for day in range(1, self.board.highestday+1):
-            for star in range(2):
-                playerdata = [((day-1) * 2 + star + 1) / 2.0]
-                for p in [_ for _ in self.board.ordered_players if _.totalscore > 0]:
-                    playerdata.append(p[day][star].accumulatedposition + 1)
-                data.append(playerdata)
+        return self.artifact("graph-accumulated_position_graph")
 
-        return self._make_return_value(data)
+    def scorediff_graph(self) -> str:
+        return self.artifact("graph-scorediff_graph")
 
     def daily_position_graph(self) -> str:
-        data = []
-        for day in range(1, self.board.highestday+1):
-            for star in range(2):
-                playerdata = [((day-1) * 2 + star + 1) / 2.0]
-                for p in [_ for _ in self.board.ordered_players if _.totalscore > 0]:
-                    playerdata.append(p[day][star].position)
-                data.append(playerdata)
+        return self.artifact("graph-daily_position_graph")
 
-        return self._make_return_value(data)
+    def get_padding(self, list_size) -> int:
+        if list_size < 10:
+            return 1
+        if list_size < 100:
+            return 2
+        return 3
 
     def common_columns(self, pos, p) -> dict:
-        pad = self.get_padding(len(self.board.ordered_players))
+        pad = self.get_padding(len(self.ordered_players))
         return {
                 "name": f"{pos:>{pad}}. {p.name}",
                 "T": p.totalscore,
@@ -134,40 +270,6 @@ class jsextractor():
             {"field": "Tob", "headerTooltip": "Tobii score"},
         ]
 
-    def score_diff(self) -> str:
-        data = []
-        for i, p in enumerate(self.board.ordered_players, start=1):
-            player_data = self.common_columns(i, p)
-            for d in range(1, self.board.highestday+1):
-                for star in range(2):
-                    player_data[f"d{d}_{star}"] = self.board.days[d][star].topscore - p[d][star].accumulatedscore
-            data.append(player_data)
-
-        return self._make_return_value(data)
-
-    def generate_two_star_data(self, *, starextractor) -> str:
-        data = []
-        for i, p in enumerate(self.board.ordered_players, start=1):
-            player_data = self.common_columns(i, p)
-            for d in range(1, self.board.highestday+1):
-                for star in range(2):
-                    player_data[f"d{d}_{star}"] = starextractor(p[d][star])
-            data.append(player_data)
-
-        return self._make_return_value(data)
-
-    def accumulated_position(self) -> str:
-        return self.generate_two_star_data(starextractor=lambda star: star.accumulatedposition + 1)
-
-    def daily_position(self) -> str:
-        return self.generate_two_star_data(starextractor=lambda star: star.position)
-
-    def global_score(self) -> str:
-        return self.generate_two_star_data(starextractor=lambda star: star.globalscore)
-
-    def tobii_score(self) -> str:
-        return self.generate_two_star_data(starextractor=lambda star: star.accumulatedtobiiscore)
-
     def coldefs_two_stars(self) -> str:
         data = self.common_coldefs()
         for d in range(1, self.board.highestday+1):
@@ -229,26 +331,3 @@ class jsextractor():
             "valueFormatter": "timedelta_to_string"
         }
         return self._make_return_value(data, make_tokens=True)
-
-    def accumulated_score(self) -> str:
-        return self.generate_two_star_data(starextractor=lambda star: star.accumulatedscore)
-
-    def time_to_second_star(self) -> str:
-        data = []
-        for i, p in enumerate(self.board.ordered_players, start=1):
-            player_data = self.common_columns(i, p)
-
-            for d in range(1, self.board.highestday+1):
-                player_data[f"d{d}"] = p[d].timetocompletestar2
-            data.append(player_data)
-
-        return self._make_return_value(data)
-
-    def time_to_complete(self) -> str:
-        return self.generate_two_star_data(starextractor=lambda star: star.timetocomplete)
-
-    def accumulated_solve_time(self) -> str:
-        return self.generate_two_star_data(starextractor=lambda star: star.accumulatedtimetocomplete)
-
-    def offset_from_winner(self) -> str:
-        return self.generate_two_star_data(starextractor=lambda star: star.offsetfromwinner)
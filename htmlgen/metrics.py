@@ -0,0 +1,89 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger("aoc")
+
+namespace = os.environ.get("METRICS_NAMESPACE", "scoreboard")
+
+# Request id of the current lambda invocation, logged with every metric line.
+invocation_id = None
+
+
+class Metrics():
+    """
+    Timers and counters of one unit of work (a board generation, an invocation).
+
+    emit() prints them as one line in CloudWatch embedded metric format, so
+    they become CloudWatch metrics (dimension: kind) and can be aggregated per
+    board and per invocation in Logs Insights through the properties.
+    Timers are in milliseconds, counters ending in "_bytes" are bytes.
+    """
+    def __init__(self, kind: str, **properties):
+        self.kind = kind
+        self.properties = properties
+        self.timings = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        # Stages run in executor threads
+        self.lock = threading.Lock()
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.timings[name] = self.timings.get(name, 0) + seconds
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, name: str, func):
+        """
+        Wrap func so the time spent in it is added to the timer name.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value) -> None:
+        """
+        Set a property, logged with the metrics but not a metric itself.
+        """
+        self.properties[name] = value
+
+    def emit(self) -> None:
+        self.add_time("total", time.perf_counter() - self.started)
+        values = {f"{name}_ms": round(seconds * 1000, 1) for name, seconds in self.timings.items()}
+        definitions = [{"Name": name, "Unit": "Milliseconds"} for name in values]
+        for name, value in self.counters.items():
+            values[name] = value
+            definitions.append({"Name": name, "Unit": "Bytes" if name.endswith("_bytes") else "Count"})
+        line = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": namespace,
+                    "Dimensions": [["kind"]],
+                    "Metrics": definitions}]},
+            "kind": self.kind,
+            "invocation": invocation_id,
+            **self.properties,
+            **values}
+        print(json.dumps(line, default=str), flush=True)
+
+
+if __name__ == "__main__":
+    raise Exception("This is just a module!")
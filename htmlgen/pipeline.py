@@ -0,0 +1,63 @@
+import asyncio
+import concurrent.futures
+import functools
+import os
+import logging
+
+logger = logging.getLogger("aoc")
+
+# Max number of boards in each stage at the same time.
+STAGE_LIMITS = {
+    "read": int(os.environ.get("PIPELINE_READ", "8")),        # DynamoDB reads/writes
+    "fetch": int(os.environ.get("PIPELINE_FETCH", "4")),      # AoC and datacache
+    "compute": int(os.environ.get("PIPELINE_COMPUTE", "1")),  # statistics and serialization
+    "upload": int(os.environ.get("PIPELINE_UPLOAD", "4")),    # artifacts to S3
+}
+
+
+class Stages():
+    """
+    Run the blocking steps of a generation in executors so the network
+    stages of several boards overlap. Network stages share a thread pool,
+    CPU work gets its own. Each stage is bounded by a semaphore.
+
+    Must be created inside the running event loop.
+    """
+    def __init__(self, limits: dict = None):
+        self.limits = {**STAGE_LIMITS, **(limits or {})}
+        self.semaphores = {name: asyncio.Semaphore(limit) for name, limit in self.limits.items()}
+        self.io = concurrent.futures.ThreadPoolExecutor(
+            max_workers=sum(limit for name, limit in self.limits.items() if name != "compute"))
+        self.cpu = concurrent.futures.ThreadPoolExecutor(max_workers=self.limits["compute"])
+
+    async def run(self, stage: str, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the executor of stage and return its result.
+        """
+        executor = self.cpu if stage == "compute" else self.io
+        async with self.semaphores[stage]:
+            logger.debug(f"{stage}: {getattr(func, '__name__', func)}")
+            return await asyncio.get_running_loop().run_in_executor(
+                executor,
+                functools.partial(func, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        self.io.shutdown()
+        self.cpu.shutdown()
+
+
+class InlineStages():
+    """
+    Stages that run every step directly in the calling thread, e.g. so a
+    profiler sees all of the work. Blocks the event loop while running.
+    """
+    async def run(self, stage: str, func, *args, **kwargs):
+        logger.debug(f"{stage} (inline): {getattr(func, '__name__', func)}")
+        return func(*args, **kwargs)
+
+    def shutdown(self) -> None:
+        pass
+
+
+if __name__ == "__main__":
+    raise Exception("This is just a module!")
@@ -0,0 +1,99 @@
+import cProfile
+import datetime
+import functools
+import io
+import os
+import pstats
+import random
+import tracemalloc
+import logging
+import boto3
+from pipeline import InlineStages
+
+logger = logging.getLogger("aoc")
+
+cache_bucket_name = os.environ.get("S3_DATACACHE", "scoreboard-datacache")
+s3client = boto3.client('s3')
+
+# Share of board generations to profile (0-1).
+profile_sample = float(os.environ.get("PROFILE_SAMPLE", "0"))
+# Comma separated board ids that are always profiled.
+profile_boards = {_.strip() for _ in os.environ.get("PROFILE_BOARDS", "").split(",") if _.strip()}
+
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+
+def enabled() -> bool:
+    """
+    Whether any board may be profiled. The profilers are process wide, so
+    profiled boards must not be generated concurrently with other boards.
+    """
+    return profile_sample > 0 or bool(profile_boards)
+
+
+def should_profile(boardid: str) -> bool:
+    return boardid in profile_boards or random.random() < profile_sample
+
+
+def profiled(func, key: str):
+    """
+    Wrap the coroutine function func (e.g. aocgen.generatelist_async) so it
+    runs under cProfile and tracemalloc and the results are stored as
+    <key>.profile.prof (pstats) and <key>.profile.txt in the datacache bucket.
+
+    The stages of func run inline, so the profile covers all of the work
+    but other boards wait while a profiled board is generated.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, stages=None, **kwargs):
+        profiler = cProfile.Profile()
+        tracemalloc.start(10)
+        profiler.enable()
+        try:
+            return await func(*args, stages=InlineStages(), **kwargs)
+        finally:
+            profiler.disable()
+            allocations = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            try:
+                save_profile(key, profiler, allocations, peak)
+            except Exception as e:
+                logger.exception(e)
+    return wrapper
+
+
+def profile_report(key: str, profiler: cProfile.Profile, allocations: tracemalloc.Snapshot, peak: int) -> str:
+    """
+    Summarize a profile: the functions with the highest cumulative time and the top allocation sites.
+    """
+    out = io.StringIO()
+    out.write(f"Profile of {key}, {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    out.write(f"Peak traced memory: {peak // 1024} KiB\n\n")
+    pstats.Stats(profiler, stream=out).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    out.write(f"Top {TOP_ALLOCATIONS} allocation sites\n")
+    for stat in allocations.statistics('lineno')[:TOP_ALLOCATIONS]:
+        out.write(f"{stat}\n")
+    return out.getvalue()
+
+
+def save_profile(key: str, profiler: cProfile.Profile, allocations: tracemalloc.Snapshot, peak: int) -> None:
+    logger.info(f"Saving profile of {key}")
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(f"/tmp/{key}.prof")
+    with open(f"/tmp/{key}.prof", "rb") as f:
+        s3client.put_object(
+            Body=f.read(),
+            Bucket=cache_bucket_name,
+            Key=f"{key}.profile.prof")
+    os.remove(f"/tmp/{key}.prof")
+    s3client.put_object(
+        Body=profile_report(key, profiler, allocations, peak).encode('utf-8'),
+        Bucket=cache_bucket_name,
+        ContentType='text/plain',
+        Key=f"{key}.profile.txt")
+
+
+if __name__ == "__main__":
+    raise Exception("This is just a module!")
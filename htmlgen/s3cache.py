@@ -1,85 +1,111 @@
 import os
 import boto3
-import json
 import scores
-import scoreboard
 import datetime
+import gzip
 import pytz
 import logging
 from botocore.exceptions import ClientError
+import scheduling
+from tieredcache import CacheEntry
 
 cache_bucket_name = os.environ.get("S3_DATACACHE", "scoreboard-datacache")
-s3client, s3resource = boto3.client('s3'), boto3.resource('s3')
+s3client = boto3.client('s3')
 logger = logging.getLogger("aoc")
 
+
 class S3Cache(scores.Cache):
-    def __init__(self,
-            bucket_name: str):
+    """
+    Raw data in the datacache bucket, gzip compressed, with the fetch time as metadata.
+
+    Body and metadata are read with a single GET. If a copy of the object is
+    already known, the GET is conditional on its ETag and a "not modified"
+    response transfers no body.
+    """
+    name = "s3"
+
+    def __init__(self, bucket_name: str):
         super().__init__()
         self._ramcache = {}
         self.bucket_name = bucket_name
         self.item_ages = {}
 
     def item_date(self, representation: scores.DataRepresentation) -> bool:
-        return self.item_ages.get(representation)
+        return self.item_ages.get(representation.filename())
 
-    def has_data(self, representation: scores.DataRepresentation) -> bool:
-        if representation in self._ramcache:
-            return True
+    def read(self, key: str, stale: CacheEntry = None) -> CacheEntry:
+        """
+        Read key from the bucket.
 
+        Args:
+            key (str): Object key.
+            stale (CacheEntry): Known copy of the object, returned as is if the object is unchanged.
+
+        Returns:
+            CacheEntry: The cached entry, None if there is none.
+        """
+        kwargs = {"IfNoneMatch": stale.etag} if stale and stale.etag else {}
         try:
-            logger.debug(f"Looking for '{representation.filename()} in bucket {self.bucket_name}.")
-            response = s3client.head_object(
+            logger.debug(f"Looking for '{key} in bucket {self.bucket_name}.")
+            response = s3client.get_object(
                 Bucket=self.bucket_name,
-                Key=representation.filename())
-            logger.debug(f"Found file. Timestamp: {response['Metadata'].get('timestamp')}")
-            tz = pytz.timezone('America/New_York')
-            now = datetime.datetime.now(tz=tz)
-            last_timestamp = int(response['Metadata'].get('timestamp', '0'))
-            last_filedate = datetime.datetime.fromtimestamp(last_timestamp, tz)
-            self.item_ages[representation] = last_filedate
-            age = now.timestamp() - last_timestamp
-
-            if last_filedate.year != now.year:
-                cool_off = datetime.timedelta(weeks=2)
-            elif now.month != 12:
-                cool_off = datetime.timedelta(weeks=2)
-            elif now.day > 25:
-                cool_off = datetime.timedelta(hours=8)
-            elif now.hour >= 3:
-                cool_off = datetime.timedelta(hours=1)
-            else:
-                cool_off = datetime.timedelta(minutes=2)
-            # cool_off = datetime.timedelta(seconds=2)
-
-            logger.debug(f"Using a cool off period of {int(cool_off.total_seconds())} seconds. Can use cached version? {age < cool_off.total_seconds()}")
-            return age < cool_off.total_seconds()
-
+                Key=key,
+                **kwargs)
         except ClientError as e:
-            logger.exception(e)
-            return False
+            if e.response.get('Error', {}).get('Code') == '304':
+                logger.debug(f"{key} is not modified.")
+                return stale
+            if e.response.get('Error', {}).get('Code') not in ['NoSuchKey', '404']:
+                logger.exception(e)
+            return None
+
+        logger.debug(f"Found file. Timestamp: {response['Metadata'].get('timestamp')}")
+        body = response['Body'].read()
+        if response.get('ContentEncoding') == 'gzip':
+            body = gzip.decompress(body)
+        return CacheEntry(
+            body.decode("utf-8"),
+            int(response['Metadata'].get('timestamp', '0')),
+            response.get('ETag'))
 
+    def put(self, key: str, entry: CacheEntry) -> CacheEntry:
+        logger.debug(f"Puttin {key} -> {self.bucket_name}.")
+        response = s3client.put_object(
+            Body=gzip.compress(entry.data.encode("utf-8"), mtime=0),
+            Bucket=self.bucket_name,
+            Key=key,
+            ContentEncoding='gzip',
+            Metadata={'timestamp': str(entry.timestamp)})
+        return entry._replace(etag=response.get('ETag'))
+
+    def has_data(self, representation: scores.DataRepresentation) -> bool:
+        key = representation.filename()
+        entry = self.read(key, self._ramcache.get(key))
+        if entry is None:
+            return False
+        self._ramcache[key] = entry
+        tz = pytz.timezone('America/New_York')
+        self.item_ages[key] = datetime.datetime.fromtimestamp(entry.timestamp, tz)
+        return scheduling.is_fresh(entry.timestamp, getattr(representation, "year", None))
 
     def add_data(self, representation: scores.DataRepresentation, data) -> None:
+        key = representation.filename()
         tz = pytz.timezone('America/New_York')
         item_time = datetime.datetime.now(tz=tz)
-        self.item_ages[representation] = item_time
-        self._ramcache[representation] = data
-        logger.debug(f"Puttin {representation.filename()} -> {self.bucket_name}.")
-
-        s3client.put_object(
-            Body=data,
-            Bucket=self.bucket_name,
-            Key=representation.filename(),
-            Metadata={'timestamp': str(int(item_time.timestamp()))
-        })
+        self.item_ages[key] = item_time
+        entry = CacheEntry(data, int(item_time.timestamp()), None)
+        self._ramcache[key] = self.put(key, entry)
 
     def get_raw(self, representation) -> str:
-        if representation in self._ramcache:
-            return self._ramcache[representation]
-        o = s3resource.Object(cache_bucket_name, representation.filename())
-        response = o.get()
-        return response['Body'].read().decode("utf-8")
+        key = representation.filename()
+        entry = self._ramcache.get(key)
+        if entry is None:
+            entry = self.read(key)
+            if entry is None:
+                raise KeyError(key)
+            self._ramcache[key] = entry
+        return entry.data
+
 
 if __name__ == "__main__":
-    raise Exception("This is just a module!")
\ No newline at end of file
+    raise Exception("This is just a module!")
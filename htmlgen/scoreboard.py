@@ -2,6 +2,12 @@ import datetime
 import logging
 import scores
 from typing import List
+from snapshot import BoardSnapshot, MemberSnapshot
+
+try:
+    import columnar
+except ImportError:
+    columnar = None
 
 
 logger = logging.getLogger("aoc")
@@ -25,24 +31,67 @@ def astime(n: int) -> str:
     return f"{h:02}:{m:02}:{n:02}"
 
 
+def competition_ranks(values: list, *, reverse: bool = False) -> dict:
+    """
+    Map each value to its 0-based competition rank, i.e. equal values
+    share the rank of the first of them and the next value skips ahead
+    ("1224"-ranking).
+
+    Args:
+        values (list): Values to rank.
+        reverse (bool, optional): Rank the largest value first. Defaults to False.
+
+    Returns:
+        dict: map <value> -> rank
+    """
+    ranks = {}
+    for i, value in enumerate(sorted(values, reverse=reverse)):
+        ranks.setdefault(value, i)
+    return ranks
+
+
+def global_score_index(scores: dict) -> dict:
+    """
+    Invert the global leaderboards of a year (map <day> -> [[names star 1], [names star 2]],
+    names being AoC names or anonymous user ids) for direct lookup per player.
+
+    Args:
+        scores (dict): Global leaderboards as stored in the globalscores table.
+
+    Returns:
+        dict: map <name|id> -> {(<day>, <star>): <position>}
+    """
+    index = {}
+    for day, stars in scores.items():
+        for star, names in enumerate(stars):
+            for position, name in enumerate(names, start=1):
+                index.setdefault(name, {}).setdefault((int(day), star), position)
+    return index
+
+
 class BaseObj():
-    pass
+    __slots__ = ()
 
 
 class Star(BaseObj):
-    def __init__(self, score: dict):
-        # print(f"Star: {score}")
-        self.completiontime = score.get('get_star_ts', None)
-        self.completiontime = int(self.completiontime) if self.completiontime else None
+    """
+    A star of a PlayerDay. The running values (RUNNING_STAR) read through
+    to the running values of the player of the day.
+    """
+    __slots__ = (
+        'completiontime', 'position', 'globalscore', 'timetocomplete', 'accumulatedtimetocomplete',
+        'offsetfromwinner', 'playerday', 'star')
+
+    def __init__(self, completiontime: int = None, *, playerday: "PlayerDay" = None, star: int = 0):
+        self.completiontime = completiontime or None
 
         self.position = None
-        self.accumulatedscore = 0
-        self.accumulatedtobiiscore = 0
-        self.accumulatedposition = None
         self.globalscore = 0
         self.timetocomplete: int = None
         self.accumulatedtimetocomplete: int = None
         self.offsetfromwinner = None
+        self.playerday = playerday
+        self.star = star
 
     @property
     def starcount(self) -> int:
@@ -52,15 +101,34 @@ class Star(BaseObj):
     def completed(self) -> bool:
         return self.completiontime is not None
 
+    @property
+    def accumulatedscore(self) -> int:
+        return self.playerday.running_value('accumulatedscore', self.star)
+
+    @property
+    def accumulatedtobiiscore(self) -> int:
+        return self.playerday.running_value('accumulatedtobiiscore', self.star)
+
+    @property
+    def accumulatedposition(self) -> int:
+        return self.playerday.running_value('accumulatedposition', self.star)
+
     def __str__(self):
         return f"{self.completiontime}"
 
 
 class PlayerDay(BaseObj):
-    def __init__(self, score: dict):
-        # print(f"Playerday: {str(score)}\n\n")
-        self.stars = [Star(score.get('1', {})), Star(score.get('2', {}))]
-        self.star2pos = 0
+    """
+    The stars of a player on a day. player and day locate the running
+    values of the day, a day without player (EMPTY_DAY) reads their
+    values before post processing.
+    """
+    __slots__ = ('stars', 'timetocompletestar2', 'player', 'day')
+
+    def __init__(self, star1: int = None, star2: int = None, *, player: "Player" = None, day: int = None):
+        self.player = player
+        self.day = day
+        self.stars = [Star(star1, playerday=self, star=0), Star(star2, playerday=self, star=1)]
         if self.starcount == 2:
             self.timetocompletestar2 = self[1].completiontime - self[0].completiontime
         else:
@@ -76,31 +144,111 @@ class PlayerDay(BaseObj):
     def starcount(self) -> int:
         return sum([_.starcount for _ in self.stars])
 
+    def running_value(self, attr: str, star: int = None):
+        """
+        The running value attr of this day (RUNNING_DAY), or of star on this day (RUNNING_STAR).
+        """
+        defaults = RUNNING_DAY if star is None else RUNNING_STAR
+        if self.player is None or self.player.running is None:
+            return defaults[attr]
+        index = self.day - 1 if star is None else star_index(self.day, star)
+        return self.player.running[attr][index]
+
+    @property
+    def star2pos(self) -> int:
+        return self.running_value('star2pos')
+
+
+# Shared stand-in for days a player has not touched. Read only!
+EMPTY_DAY = PlayerDay()
+
+# Running values every player has on every day, kept per player in running
+# (see Player) instead of on the PlayerDay/Star of each day.
+# attr -> value before post processing
+RUNNING_STAR = {'accumulatedscore': 0, 'accumulatedtobiiscore': 0, 'accumulatedposition': None}
+RUNNING_DAY = {'star2pos': 0}
+
+
+def star_index(day: int, star: int) -> int:
+    """
+    Index of day/star in the running star values of a player.
+    """
+    return (day - 1) * 2 + star
+
 
 class Player(BaseObj):
-    def __init__(self, score: dict, *, daycount=25, leaderboard):
+    """
+    Only the days the player solved something are allocated. Reading
+    player[day] (or player.get(day)) never allocates a day, write to
+    player.day(day), which allocates it on first use.
+
+    The running values (RUNNING_STAR, RUNNING_DAY) of all days are kept in
+    running, map <attr> -> list, star values indexed by star_index. They are
+    allocated by the python engine (see init_running), None until then.
+    player[day][star].accumulatedscore etc. read them.
+    """
+    __slots__ = (
+        'daycount', 'days', 'running', 'totalscore', 'laststar', 'globalscore', 'localscore', 'id', 'name',
+        'aocname', 'pendingpoints', 'accumulatedtobiiscoretotal', 'position', 'props')
+
+    def __init__(self, member: MemberSnapshot, *, daycount=25, leaderboard):
         self.daycount = daycount
-        self.days = {int(_): PlayerDay(score['completion_day_level'][_]) for _ in score['completion_day_level'].keys()}
-        self.days.update({_: PlayerDay({}) for _ in range(1, daycount+1) if _ not in self.days})
+        times = member.completion
+        self.days = {
+            day // 2 + 1: PlayerDay(times[day], times[day + 1], player=self, day=day // 2 + 1)
+            for day in range(0, len(times), 2) if times[day]}
+        self.running = None
         self.totalscore = 0
-        self.laststar = int(score.get('last_star_ts', 0))
-        self.globalscore = score['global_score']
-        self.localscore = score['local_score']
-        self.id = score['id']
-        self.name = score['name'] or self.id
+        self.laststar = member.last_star_ts
+        self.globalscore = member.global_score
+        self.localscore = member.local_score
+        self.id = member.id
+        self.name = member.name or self.id
+        self.aocname = self.name
         self.pendingpoints = 0
         self.accumulatedtobiiscoretotal = 0
         self.position = None
         self.props = ""
 
+    def init_running(self) -> None:
+        self.running = {
+            **{attr: [value] * (self.daycount * 2) for attr, value in RUNNING_STAR.items()},
+            **{attr: [value] * self.daycount for attr, value in RUNNING_DAY.items()}}
+
     def __str__(self):
         days = [str(self.days[_]) for _ in sorted(self.days)]
         return f"{self.position:3} {self.name} ({self.id}) - {self.localscore}/{self.globalscore} " \
             + f"{'*' * self.stars} ({self.stars})" \
             + "\n\t* " + "\n\t* ".join(days)
 
-    def __getitem__(self, index):
-        return self.days[index]
+    def __getitem__(self, index) -> PlayerDay:
+        """
+        Day index of the player, read only. A day the player did not touch is
+        not added to days: it is EMPTY_DAY, or once the running values exist a
+        throwaway unsolved day to read them through.
+        """
+        day = self.days.get(index)
+        if day is None:
+            if self.running is None:
+                return EMPTY_DAY
+            return PlayerDay(player=self, day=index)
+        return day
+
+    def get(self, index) -> PlayerDay:
+        """
+        Day index of the player, EMPTY_DAY if the player did not touch it.
+        Cheaper than player[index] but without the running values of untouched days.
+        """
+        return self.days.get(index, EMPTY_DAY)
+
+    def day(self, index) -> PlayerDay:
+        """
+        Day index of the player to write to, allocated on first use.
+        """
+        day = self.days.get(index)
+        if day is None:
+            day = self.days[index] = PlayerDay(player=self, day=index)
+        return day
 
     @property
     def stars(self):
@@ -139,18 +287,23 @@ class LeaderBoard(BaseObj):
     def __init__(
             self, *,
             title: str,
-            score: dict,
+            score: dict = None,
             year: str,
             highestday: int,
             namemap: dict,
             uuid=str,
             global_scores: dict,
-            nopoint_days: List[int]):
+            nopoint_days: List[int],
+            engine: str = "python",
+            snapshot: BoardSnapshot = None):
+        """
+        The board is built from snapshot, or from score (the parsed AoC json) if there is no snapshot.
+        """
         self.year = year
         self.title = title
-        self.score = score
-        self.boardid = score['owner_id']
-        self.players = [Player(_, daycount=highestday, leaderboard=self) for _ in score['members'].values()]
+        self.snapshot = snapshot or BoardSnapshot.from_score(score)
+        self.boardid = self.snapshot.owner_id
+        self.players = [Player(_, daycount=highestday, leaderboard=self) for _ in self.snapshot.members]
         self.global_scores = global_scores
         self.uuid = uuid
         self.nopoint_days = nopoint_days
@@ -161,6 +314,8 @@ class LeaderBoard(BaseObj):
 
         self.highestday = highestday
         self.excludezero = False
+        self.engine = engine
+        self.columns = None
 
         self.days = {}
 
@@ -168,7 +323,7 @@ class LeaderBoard(BaseObj):
             for player in self.players:
                 self.days[day] = [BoardStar(), BoardStar()]
                 for star in range(2):
-                    self.days[day][star].starsawarded += player[day][star].starcount
+                    self.days[day][star].starsawarded += player.get(day)[star].starcount
 
     @property
     def today(self):
@@ -181,68 +336,175 @@ class LeaderBoard(BaseObj):
             key=lambda x: (x.localscore, x.laststar, x.id),
             reverse=True)
 
+    @property
+    def uses_columns(self) -> bool:
+        """
+        Whether the statistics are computed by the columnar engine (see columnar.ColumnarStats).
+        """
+        return self.engine == "numpy" and columnar is not None
+
     def day_excluded(self, day):
         return day in self.nopoint_days
 
+    def star_values(self, player: Player, attr: str) -> list:
+        """
+        Return attr of both stars for each day, i.e. [[day1_star1, day1_star2], ...].
+        """
+        if self.columns is not None and attr in self.columns.stars:
+            return self.columns.star_values(player, attr)
+        if attr in RUNNING_STAR:
+            if player.running is None:
+                return [[RUNNING_STAR[attr]] * 2 for _ in range(self.highestday)]
+            values = player.running[attr]
+            return [values[i:i + 2] for i in range(0, self.highestday * 2, 2)]
+        return [[getattr(player.get(d)[star], attr) for star in range(2)] for d in range(1, self.highestday+1)]
+
+    def day_values(self, player: Player, attr: str) -> list:
+        """
+        Return attr of each day, i.e. [day1, day2, ...].
+        """
+        if self.columns is not None and attr in self.columns.days:
+            return self.columns.day_values(player, attr)
+        if attr in RUNNING_DAY:
+            if player.running is None:
+                return [RUNNING_DAY[attr]] * self.highestday
+            return player.running[attr][:self.highestday]
+        return [getattr(player.get(d), attr) for d in range(1, self.highestday+1)]
+
     def update_global_scores(self):
         logger.info("Updating global scores")
-        for player in [_ for _ in self.players if _ in self.global_scores['names']]:
-            for d in range(1, self.highestday+1):
+        index = self.global_scores.get('index')
+        if index is None:
+            index = global_score_index(self.global_scores.get('scores', {}))
+        for player in self.players:
+            positions = index.get(player.aocname) or index.get(str(player.id))
+            if not positions:
+                continue
+            for (d, star), pos in positions.items():
+                if d > self.highestday:
+                    continue
+                points = 101 - pos
+                logger.info(f"{player.name} scored {points} points on day {d} (star {star}), year {self.year}")
+                player.day(d)[star].globalscore = points
+
+    def first_changed_day(self, previous: "LeaderBoard") -> int:
+        """
+        Find the first day where the statistics of previous (computed from an
+        earlier snapshot of the same board) can not be reused.
+
+        Args:
+            previous (LeaderBoard): Board with statistics post processed by the same engine, or None.
+
+        Returns:
+            int: First day to compute, 1 if nothing can be reused.
+        """
+        if previous is None or previous.uses_columns != self.uses_columns:
+            return 1
+        if (previous.boardid, previous.year, previous.nopoint_days, previous.excludezero) != \
+                (self.boardid, self.year, self.nopoint_days, self.excludezero):
+            return 1
+        old_times = {_.id: _.completion for _ in previous.snapshot.members}
+        if old_times.keys() != {_.id for _ in self.snapshot.members}:
+            return 1
+
+        firstday = min(previous.highestday, self.highestday) + 1
+        for member in self.snapshot.members:
+            old = old_times[member.id]
+            if old == member.completion:
+                continue
+            changed = next(i for i, (a, b) in enumerate(zip(old, member.completion)) if a != b)
+            firstday = min(firstday, changed // 2 + 1)
+        return firstday
+
+    def reuse_stats(self, previous: "LeaderBoard", player_count: int) -> int:
+        """
+        Take over the statistics of the days that did not change since previous
+        was computed and set the running totals as they were after the last of them.
+
+        Returns:
+            int: First day that still needs to be computed.
+        """
+        firstday = self.first_changed_day(previous)
+        if firstday == 1:
+            return firstday
+
+        logger.info(f"Reusing statistics for day 1-{firstday-1}")
+        old_players = {_.id: _ for _ in previous.players}
+        last = star_index(firstday - 1, 1)
+        for player in self.players:
+            old_player = old_players[player.id]
+            for day in range(1, firstday):
+                playerday = old_player.days.get(day)
+                if playerday is not None:
+                    for star in range(2):
+                        playerday[star].globalscore = player.get(day)[star].globalscore
+                    playerday.player = player
+                    player.days[day] = playerday
                 for star in range(2):
-                    global_stars = self.global_scores['scores'][d]
-                    pos = None
-                    if player.name in global_stars:
-                        pos = global_stars.index(player.name)
-                    elif player.id in global_stars:
-                        pos = global_stars.index(player.id)
-                    if pos:
-                        points = 101 - pos
-                        logger.info(f"{player.name} scored {points} points on day {d} (star {star}), year {self.year}")
-                        player[d][star].globalscore = points
-
-    def post_process_stats(self) -> None:
+                    if not player.get(day)[star].completed:
+                        player.pendingpoints += player_count - self.days[day][star].starsawarded
+            for attr in RUNNING_STAR:
+                player.running[attr][:last + 1] = old_player.running[attr][:last + 1]
+            for attr in RUNNING_DAY:
+                player.running[attr][:firstday - 1] = old_player.running[attr][:firstday - 1]
+            player.totalscore = player.running['accumulatedscore'][last]
+            player.localscore = player.totalscore
+            player.accumulatedtobiiscoretotal = player.running['accumulatedtobiiscore'][last]
+        for day in range(1, firstday):
+            self.days[day] = previous.days[day]
+        return firstday
+
+    def post_process_stats(self, previous: "LeaderBoard" = None) -> None:
+        """
+        Compute all statistics.
+
+        Args:
+            previous (LeaderBoard, optional): The same board computed from an earlier
+            snapshot. Days that did not change since are not recomputed. Defaults to None.
+        """
+        if self.engine == "numpy":
+            if columnar is not None:
+                self.columns = columnar.ColumnarStats(self).run(previous)
+                return
+            logger.warning("numpy is not available, using the python engine")
+
         logger.info("Post processing")
         if self.excludezero:
             player_count = len([_ for _ in self.players if _.starcount > 0])
         else:
             player_count = len(self.players)
 
-        laststar = {p: 0 for p in self.players}
-
-        for day in range(1, self.highestday + 1):
+        for player in self.players:
+            player.init_running()
+        firstday = self.reuse_stats(previous, player_count)
+        for day in range(firstday, self.highestday + 1):
             publish_time = int(datetime.datetime(year=int(self.year), month=12, day=day, hour=6).timestamp())
             for player in self.players:
+                playerday = player.get(day)
                 for star in range(2):
-                    thestar = player[day][star]
+                    thestar = playerday[star]
                     if thestar.completed:
                         thestar.timetocomplete = thestar.completiontime - publish_time
                         timespan = thestar.completiontime - publish_time
-                        lasttime = 0 if day == 1 else player[day-1][1].accumulatedtimetocomplete
+                        lasttime = 0 if day == 1 else player.get(day-1)[1].accumulatedtimetocomplete
                         if lasttime is not None:
                             thestar.accumulatedtimetocomplete = lasttime + timespan
                             self.days[day][star].besttime = timespan
                     else:
                         player.pendingpoints += player_count - self.days[day][star].starsawarded
             # Now loop again and resolve board offsets etc
-            # for day in range(1, self.highestday + 1):
             for star in range(2):
-                ordered_players = sorted(
-                    [_ for _ in self.players if _[day][star].completed],
-                    key=lambda x: (x[day][star].completiontime, laststar.get(x, 0)))
-
-                for player in sorted(
-                    self.players,
-                        key=lambda x: (x[day][star].completiontime or -1, laststar.get(x, 0))):
-                    thestar = player[day][star]
-                    if thestar.completed:
-                        index = ordered_players.index(player)
+                i = star_index(day, star)
+                # Players with the same completion time share the position
+                # of the first of them.
+                ranks = competition_ranks(
+                    [_.get(day)[star].completiontime for _ in self.players if _.get(day)[star].completed])
 
-                        # Handle ties by setting index to the same as
-                        # the player just ahead with the same completion time.
-                        if index > 0 and thestar.completiontime == ordered_players[index-1][day][star].completiontime:
-                            index = ordered_players[index-1][day][star].position - 1
+                for player in self.players:
+                    thestar = player.get(day)[star]
+                    if thestar.completed:
+                        index = ranks[thestar.completiontime]
                         thestar.position = index + 1
-                        # print(f"{player.name} {day}/{star}: {player[day][star].position} -- {thestar.position}")
 
                         if not self.day_excluded(day):
                             player.totalscore += player_count - index
@@ -250,36 +512,29 @@ class LeaderBoard(BaseObj):
                         besttime = self.days[day][star].besttime
                         if besttime is not None:
                             thestar.offsetfromwinner = thestar.completiontime - publish_time - besttime
-                        laststar[player] = thestar.completiontime
                     else:
                         if not self.day_excluded(day):
                             player.accumulatedtobiiscoretotal += len(self.players)
 
-                    thestar.accumulatedscore = player.totalscore
+                    player.running['accumulatedscore'][i] = player.totalscore
                     self.days[day][star].topscore = player.totalscore
-                    thestar.accumulatedtobiiscore = player.accumulatedtobiiscoretotal
+                    player.running['accumulatedtobiiscore'][i] = player.accumulatedtobiiscoretotal
                     # Why set localscore to totalscore? Are both properties needed? Will they ever differ?
                     player.localscore = player.totalscore
 
             for star in range(2):
-                ordered_players = sorted(
-                    [_ for _ in self.players if _[day][star].accumulatedscore > 0],
-                    key=lambda x: x[day][star].accumulatedscore,
+                i = star_index(day, star)
+                # Players without any score are not placed (-1).
+                ranks = competition_ranks(
+                    [_.running['accumulatedscore'][i] for _ in self.players if _.running['accumulatedscore'][i] > 0],
                     reverse=True)
                 for player in self.players:
-                    if player in ordered_players:
-                        index = ordered_players.index(player)
-                    else:
-                        index = -1
-                    # Handle ties
-                    if index > 0 and player[day][star].accumulatedscore == ordered_players[index-1][day][star].accumulatedscore:  # noqa e501
-                        player[day][star].accumulatedposition = ordered_players[index-1][day][star].accumulatedposition
-                    else:
-                        player[day][star].accumulatedposition = index
+                    player.running['accumulatedposition'][i] = ranks.get(player.running['accumulatedscore'][i], -1)
 
+        last = star_index(self.highestday, 1)
         ordered_players = sorted(
             [_ for _ in self.players],
-            key=lambda x: x[day][star].accumulatedscore,
+            key=lambda x: x.running['accumulatedscore'][last] if self.highestday else 0,
             reverse=True)
         for i, player in enumerate(ordered_players):
             ordered_players[i].position = i+1
@@ -287,24 +542,23 @@ class LeaderBoard(BaseObj):
         # for p in sorted(ordered_players, key=lambda x: x.totalscore, reverse=True):
         #     print(f"{p.name:<20} - {p[day][star].completiontime} - {p.totalscore}")
 
-        for day in range(1, self.highestday+1):
+        for day in range(firstday, self.highestday+1):
             players = sorted(
-                [_ for _ in self.players if _[day].starcount == 2],
-                key=lambda x: x[day].timetocompletestar2)
+                [_ for _ in self.players if _.get(day).starcount == 2],
+                key=lambda x: x.get(day).timetocompletestar2)
             for i, player in enumerate(players):
-                player[day].star2pos = i+1
-                if i > 0 and player[day].timetocompletestar2 == players[i-1][day].timetocompletestar2:
-                    player[day].star2pos = i
-            for player in [_ for _ in self.players if _[day].starcount != 2]:
-                player[day].star2pos = len(self.players)+1
+                player.running['star2pos'][day-1] = i+1
+                if i > 0 and player.get(day).timetocompletestar2 == players[i-1].get(day).timetocompletestar2:
+                    player.running['star2pos'][day-1] = i
+            for player in [_ for _ in self.players if _.get(day).starcount != 2]:
+                player.running['star2pos'][day-1] = len(self.players)+1
 
     def leaderboard_data(self):
         res = []
         for i, p in enumerate(self.ordered_players):
             player_data = [i, p.name, p.totalscore, p.globalscore, p.stars, p.accumulatedtobiiscoretotal]
-            for d in range(1, self.highestday+1):
-                for star in range(2):
-                    player_data.append(p[d][star].position if p[d][star].position else -1)
+            for positions in self.star_values(p, 'position'):
+                player_data.extend([_ if _ else -1 for _ in positions])
             res.append(player_data)
         return res
 
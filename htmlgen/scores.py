@@ -1,7 +1,7 @@
 import pathlib
 import json
 import logging
-import requests
+from aochttp import client
 
 logger = logging.getLogger(("aoc"))
 
@@ -26,19 +26,18 @@ class DataRepresentation():
 
 class Downloader():
     def __init__(self, sessionid: str = None):
-        self.jar = requests.cookies.RequestsCookieJar()
-        if sessionid:
-            self.jar.set("session", sessionid, domain=".adventofcode.com", path='/')
-        else:
+        self.sessionid = sessionid
+        if not sessionid:
             logger.warning("NOT setting sessionid")
 
     def get_data(self, representation: DataRepresentation):
         url = representation.url()
         logger.debug(f"Downloading from {url}")
-        headers = {'user-agent': 'Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.0; .NET CLR 1.0.3705)'}
-        r = requests.get(url, cookies=self.jar, headers=headers)
-        logger.debug(f"Downloading done... [{r.content.decode()[:20]}]")
-        return r.content.decode()
+        r = client.get(url, sessionid=self.sessionid)
+        r.raise_for_status()
+        data = r.content.decode()
+        logger.debug(f"Downloading done... [{data[:20]}]")
+        return data
 
 class Cache():
     def has_data(self, representation: DataRepresentation) -> bool:
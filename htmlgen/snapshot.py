@@ -0,0 +1,231 @@
+import collections
+import hashlib
+import json
+import json.decoder
+import struct
+import logging
+
+logger = logging.getLogger("aoc")
+
+MAGIC = b"AOCS"
+SNAPSHOT_VERSION = 1
+DAYS = 25
+
+# magic, version, days per member, member count
+HEADER = struct.Struct("<4sHBI")
+# local_score, global_score, last_star_ts
+MEMBER = struct.Struct("<qqq")
+# Completion time of each day/star, day 1 star 1 first. 0 if not completed.
+COMPLETION = struct.Struct(f"<{DAYS * 2}I")
+
+# Value tags, ids can be strings or ints depending on the year of the AoC api.
+TAG_NONE, TAG_INT, TAG_STR = 0, 1, 2
+
+WHITESPACE = json.decoder.WHITESPACE
+decoder = json.JSONDecoder()
+
+# completion: tuple of DAYS * 2 timestamps, 0 if the star is not completed.
+MemberSnapshot = collections.namedtuple(
+    "MemberSnapshot",
+    "id name local_score global_score last_star_ts completion")
+
+
+def source_hash(raw: str) -> str:
+    """
+    Identify the raw leaderboard json a snapshot was made from.
+    """
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def completion_times(levels: dict) -> tuple:
+    """
+    Convert the completion_day_level of an AoC member to a completion tuple.
+    """
+    times = [0] * (DAYS * 2)
+    for day, stars in levels.items():
+        for star, completion in stars.items():
+            times[(int(day) - 1) * 2 + int(star) - 1] = int(completion['get_star_ts'])
+    return tuple(times)
+
+
+def member_snapshot(member: dict) -> MemberSnapshot:
+    return MemberSnapshot(
+        member['id'],
+        member['name'],
+        int(member['local_score']),
+        int(member['global_score']),
+        int(member.get('last_star_ts', 0)),
+        completion_times(member['completion_day_level']))
+
+
+def expect(raw: str, index: int, char: str) -> int:
+    """
+    Skip whitespace and char at index of raw.
+
+    Returns:
+        int: index after char
+    """
+    index = WHITESPACE.match(raw, index).end()
+    if raw[index:index + 1] != char:
+        raise ValueError(f"Expected '{char}' at position {index}")
+    return WHITESPACE.match(raw, index + 1).end()
+
+
+def decode_object(raw: str, index: int, decode_value) -> tuple:
+    """
+    Decode the json object at index of raw one value at a time,
+    with decode_value(key, raw, index) -> (value, index after the value).
+
+    Returns:
+        tuple: (list of (key, value), index after the object)
+    """
+    items = []
+    index = expect(raw, index, '{')
+    if raw[index:index + 1] == '}':
+        return items, index + 1
+    while True:
+        key, index = decoder.raw_decode(raw, index)
+        if not isinstance(key, str):
+            raise ValueError(f"Expected a key before position {index}")
+        index = expect(raw, index, ':')
+        value, index = decode_value(key, raw, index)
+        items.append((key, value))
+        index = WHITESPACE.match(raw, index).end()
+        if raw[index:index + 1] == '}':
+            return items, index + 1
+        index = expect(raw, index, ',')
+
+
+def pack_value(value) -> bytes:
+    if value is None:
+        return bytes([TAG_NONE])
+    if isinstance(value, int):
+        return bytes([TAG_INT]) + struct.pack("<q", value)
+    encoded = str(value).encode('utf-8')
+    return bytes([TAG_STR]) + struct.pack("<I", len(encoded)) + encoded
+
+
+def unpack_value(data: bytes, offset: int) -> tuple:
+    """
+    Returns:
+        tuple: (value, offset after the value)
+    """
+    tag = data[offset]
+    offset += 1
+    if tag == TAG_NONE:
+        return None, offset
+    if tag == TAG_INT:
+        return struct.unpack_from("<q", data, offset)[0], offset + 8
+    length = struct.unpack_from("<I", data, offset)[0]
+    offset += 4
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+class BoardSnapshot():
+    """
+    The parsed content of an AoC leaderboard, everything LeaderBoard needs.
+
+    Members are kept in the order of the AoC json. source is the
+    source_hash of the json the snapshot was made from (None if unknown).
+    """
+    def __init__(self, owner_id, members: list, source: str = None):
+        self.owner_id = owner_id
+        self.members = members
+        self.source = source
+
+    @classmethod
+    def from_score(cls, score: dict, source: str = None) -> "BoardSnapshot":
+        """
+        Make a snapshot of a leaderboard parsed from the AoC json.
+        """
+        members = [member_snapshot(_) for _ in score['members'].values()]
+        return cls(score['owner_id'], members, source)
+
+    @classmethod
+    def parse(cls, raw: str) -> "BoardSnapshot":
+        """
+        Make a snapshot of the AoC json raw without building the dict of the whole board.
+        Members are decoded one at a time and only their snapshot is kept.
+
+        Raises:
+            ValueError: raw is not a valid leaderboard.
+        """
+        def decode_member(key: str, raw: str, index: int) -> tuple:
+            member, index = decoder.raw_decode(raw, index)
+            try:
+                return member_snapshot(member), index
+            except (KeyError, TypeError, AttributeError) as e:
+                raise ValueError(f"Invalid member {key}: {e}")
+
+        def decode_field(key: str, raw: str, index: int) -> tuple:
+            if key == 'members':
+                members, index = decode_object(raw, index, decode_member)
+                return [member for _, member in members], index
+            return decoder.raw_decode(raw, index)
+
+        fields, _ = decode_object(raw, 0, decode_field)
+        fields = dict(fields)
+        try:
+            return cls(fields['owner_id'], fields['members'], source_hash(raw))
+        except KeyError as e:
+            raise ValueError(f"Leaderboard without {e}")
+
+    def activity(self) -> dict:
+        """
+        Returns:
+            dict: last_star: the latest star of any member (0 if none), stars: the number of stars of all members.
+        """
+        return {
+            "last_star": max((_.last_star_ts for _ in self.members), default=0),
+            "stars": sum(1 for member in self.members for _ in member.completion if _)}
+
+    def dumps(self) -> bytes:
+        parts = [
+            HEADER.pack(MAGIC, SNAPSHOT_VERSION, DAYS, len(self.members)),
+            pack_value(self.source),
+            pack_value(self.owner_id)]
+        for member in self.members:
+            parts.append(pack_value(member.id))
+            parts.append(pack_value(member.name))
+            parts.append(MEMBER.pack(member.local_score, member.global_score, member.last_star_ts))
+        parts.extend(COMPLETION.pack(*member.completion) for member in self.members)
+        return b"".join(parts)
+
+    @classmethod
+    def loads(cls, data: bytes) -> "BoardSnapshot":
+        """
+        Read a snapshot written by dumps.
+
+        Raises:
+            ValueError: data is not a snapshot of this version.
+        """
+        if len(data) < HEADER.size:
+            raise ValueError("Snapshot is truncated")
+        magic, version, days, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != SNAPSHOT_VERSION or days != DAYS:
+            raise ValueError(f"Unsupported snapshot ({magic}, version {version}, {days} days)")
+        offset = HEADER.size
+        members = []
+        try:
+            source, offset = unpack_value(data, offset)
+            owner_id, offset = unpack_value(data, offset)
+            for _ in range(count):
+                memberid, offset = unpack_value(data, offset)
+                name, offset = unpack_value(data, offset)
+                scores = MEMBER.unpack_from(data, offset)
+                offset += MEMBER.size
+                members.append((memberid, name, scores))
+        except (struct.error, IndexError):
+            raise ValueError("Snapshot is truncated")
+        if len(data) != offset + count * COMPLETION.size:
+            raise ValueError("Snapshot is truncated")
+        completions = COMPLETION.iter_unpack(data[offset:])
+        return cls(
+            owner_id,
+            [MemberSnapshot(memberid, name, *scores, completion)
+             for (memberid, name, scores), completion in zip(members, completions)],
+            source)
+
+
+if __name__ == "__main__":
+    raise Exception("This is just a module!")
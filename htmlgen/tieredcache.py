@@ -0,0 +1,191 @@
+import collections
+import datetime
+import json
+import os
+import pathlib
+import threading
+import logging
+import pytz
+import scheduling
+import scores
+
+logger = logging.getLogger("aoc")
+
+# data: the raw data, timestamp: when it was fetched from AoC, etag: of the datacache object (None if unknown)
+CacheEntry = collections.namedtuple("CacheEntry", "data timestamp etag")
+
+
+class MemoryTier():
+    """
+    Process wide LRU of cache entries, bounded by the total size of the cached data in (utf-8) bytes.
+    """
+    name = "ram"
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # map <key> -> (<entry>, <size in bytes>)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def read(self, key: str, stale: CacheEntry = None) -> CacheEntry:
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key: str, entry: CacheEntry) -> CacheEntry:
+        size = len(entry.data.encode('utf-8'))
+        if size > self.max_bytes:
+            return entry
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (entry, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+        return entry
+
+
+class DiskTier():
+    """
+    Cache entries in files under rootdir (/tmp survives between invocations of a warm lambda).
+    Each file starts with a json line holding timestamp and etag, followed by the data.
+    """
+    name = "disk"
+
+    def __init__(self, rootdir: pathlib.Path, max_bytes: int):
+        self.rootdir = rootdir
+        self.max_bytes = max_bytes
+
+    def read(self, key: str, stale: CacheEntry = None) -> CacheEntry:
+        try:
+            with open(self.rootdir / key, encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                return CacheEntry(f.read(), header["timestamp"], header["etag"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, entry: CacheEntry) -> CacheEntry:
+        try:
+            self.rootdir.mkdir(parents=True, exist_ok=True)
+            filename = self.rootdir / key
+            # Write to a temporary file first, other workers may read the file at the same time.
+            tmpname = filename.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmpname, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({"timestamp": entry.timestamp, "etag": entry.etag}) + "\n")
+                f.write(entry.data)
+            os.replace(tmpname, filename)
+            self.evict()
+        except OSError as e:
+            logger.warning(f"Could not write {key} to the disk cache: {e}")
+        return entry
+
+    def evict(self) -> None:
+        """
+        Remove the least recently written files until the tier fits in max_bytes.
+        """
+        files = [(f.stat(), f) for f in self.rootdir.iterdir() if f.suffix != ".tmp"]
+        size = sum(stat.st_size for stat, _ in files)
+        for stat, f in sorted(files, key=lambda _: _[0].st_mtime):
+            if size <= self.max_bytes:
+                break
+            f.unlink()
+            size -= stat.st_size
+
+
+class TieredCache(scores.Cache):
+    """
+    Cache raw data in a list of tiers, fastest first (e.g. RAM, disk, S3).
+
+    Data is looked up tier by tier and served from the first tier where it
+    is still within its cool off period. Hits are copied to the tiers above,
+    new data is written to all tiers, bottom up.
+
+    A tier has a name and implements
+    * read(key, stale) -> CacheEntry or None. stale is the newest out of date
+      entry found in the tiers above, which a remote tier may use for a
+      conditional read.
+    * put(key, entry) -> CacheEntry: the stored entry, possibly with an etag.
+
+    stats holds the number of hits and misses per tier. The bookkeeping is
+    shared by concurrent generations and guarded by lock, the tiers lock
+    themselves.
+    """
+    def __init__(self, tiers: list):
+        super().__init__()
+        self.tiers = tiers
+        self.item_ages = {}
+        # Entries found by has_data/add_data, handed over to get_raw.
+        self.found = {}
+        # Name of the tier (or "aoc" for new data) the last data of a key came from.
+        self.sources = {}
+        self.stats = {tier.name: {"hit": 0, "miss": 0} for tier in tiers}
+        self.lock = threading.Lock()
+
+    def item_date(self, representation: scores.DataRepresentation) -> datetime.datetime:
+        with self.lock:
+            return self.item_ages.get(representation.filename())
+
+    def set_item_date(self, key: str, timestamp: int) -> None:
+        tz = pytz.timezone('America/New_York')
+        with self.lock:
+            self.item_ages[key] = datetime.datetime.fromtimestamp(timestamp, tz)
+
+    def has_data(self, representation: scores.DataRepresentation) -> bool:
+        key = representation.filename()
+        stale = None
+        for i, tier in enumerate(self.tiers):
+            entry = tier.read(key, stale)
+            if entry is not None:
+                self.set_item_date(key, entry.timestamp)
+                if scheduling.is_fresh(entry.timestamp, getattr(representation, "year", None)):
+                    logger.debug(f"Found {key} in the {tier.name} cache")
+                    for upper in self.tiers[:i]:
+                        upper.put(key, entry)
+                    with self.lock:
+                        self.stats[tier.name]["hit"] += 1
+                        self.found[key] = entry
+                        self.sources[key] = tier.name
+                    return True
+                if entry.etag and (stale is None or entry.timestamp > stale.timestamp):
+                    stale = entry
+            with self.lock:
+                self.stats[tier.name]["miss"] += 1
+        return False
+
+    def add_data(self, representation: scores.DataRepresentation, data) -> None:
+        key = representation.filename()
+        entry = CacheEntry(data, int(datetime.datetime.now().timestamp()), None)
+        self.set_item_date(key, entry.timestamp)
+        for tier in reversed(self.tiers):
+            entry = tier.put(key, entry)
+        with self.lock:
+            self.found[key] = entry
+            self.sources[key] = "aoc"
+
+    def source(self, representation: scores.DataRepresentation) -> str:
+        """
+        Where the last data for representation came from, the name of a tier or "aoc".
+        """
+        with self.lock:
+            return self.sources.get(representation.filename())
+
+    def get_raw(self, representation) -> str:
+        key = representation.filename()
+        with self.lock:
+            entry = self.found.pop(key, None)
+        if entry is not None:
+            return entry.data
+        for tier in self.tiers:
+            entry = tier.read(key)
+            if entry is not None:
+                return entry.data
+        raise KeyError(key)
+
+
+if __name__ == "__main__":
+    raise Exception("This is just a module!")
@@ -6,6 +6,7 @@ import lxml
 import logging
 from lxml import html
 from boto3.dynamodb.conditions import Key
+from aochttp import client
 
 globalscores_table_name = os.environ.get("DDB_GLOBALSCORES", "scoreboard-globalscores")
 globalscores_table = boto3.resource('dynamodb').Table(globalscores_table_name)
@@ -29,9 +30,7 @@ def get_file(url: str) -> str:
         str: contentr of data downloaded from url
     """
     logging.info(f"Downloading {url}")
-    headers = {'user-agent': 'Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.0; .NET CLR 1.0.3705)'}
-    r = requests.get(url, headers=headers)
-    return r
+    return client.get(url)
 
 def parse_file(data) -> dict:
     """
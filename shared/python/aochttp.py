@@ -0,0 +1,139 @@
+import os
+import random
+import threading
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("aoc")
+
+USER_AGENT = "github.com/jhogstrom/aoc-highscores"
+
+# Responses worth another attempt.
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimitExceeded(Exception):
+    """
+    The request may not be made yet, retry after retry_after seconds.
+    """
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket():
+    """
+    Allow bursts of <capacity> requests, refilled with <rate> requests per second.
+    """
+    def __init__(self, *, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, max_wait: float) -> None:
+        """
+        Take a token, waiting at most max_wait seconds for one.
+
+        Raises:
+            RateLimitExceeded: No token becomes available in time.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0
+            if wait > max_wait:
+                raise RateLimitExceeded(f"Next request allowed in {wait:.1f} seconds", wait)
+            # Reserve the token now, the bucket may go negative while we wait.
+            self.tokens -= 1
+        if wait:
+            logger.debug(f"Rate limited, waiting {wait:.1f} seconds")
+            time.sleep(wait)
+
+
+class AocClient():
+    """
+    HTTP client for adventofcode.com.
+
+    Connections are pooled and kept alive, and the module level client is
+    reused for the lifetime of the (warm) lambda. Every request has a timeout
+    and is retried with jittered exponential backoff. Requests are rate
+    limited per AoC session with a token bucket, callers that cannot wait
+    get RateLimitExceeded with the time to retry after.
+
+    How often a single leaderboard may be fetched is decided by the caller,
+    see scheduling.fetch_delay.
+    """
+    def __init__(
+            self, *,
+            timeout: tuple = (3.05, 10),
+            retries: int = 3,
+            backoff: float = 0.5,
+            rate_per_minute: float = 10,
+            burst: int = 10,
+            max_wait: float = 5):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_wait = max_wait
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Start with a new connection pool. A forked process must not use the sockets of its parent.
+        """
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.session.headers.update({'user-agent': USER_AGENT})
+
+    def bucket(self, sessionid: str) -> TokenBucket:
+        with self.lock:
+            if sessionid not in self.buckets:
+                self.buckets[sessionid] = TokenBucket(rate=self.rate_per_minute / 60, capacity=self.burst)
+            return self.buckets[sessionid]
+
+    def get(self, url: str, *, sessionid: str = None) -> requests.Response:
+        """
+        GET url, authenticated with sessionid if given.
+
+        Raises:
+            RateLimitExceeded: Too many requests for the session.
+            requests.RequestException: The request failed on the last attempt.
+
+        Returns:
+            requests.Response: The response of the last attempt.
+        """
+        self.bucket(sessionid).acquire(self.max_wait)
+        cookies = {"session": sessionid} if sessionid else None
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                response = self.session.get(url, cookies=cookies, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS or last_attempt:
+                    return response
+                logger.warning(f"{url} responded {response.status_code} (attempt {attempt + 1})")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last_attempt:
+                    raise
+                logger.warning(f"{url} failed: {e} (attempt {attempt + 1})")
+            finally:
+                # Never let the cookies of one session leak into the requests of another.
+                self.session.cookies.clear()
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+client = AocClient(
+    rate_per_minute=float(os.environ.get("AOC_RATE_PER_MINUTE", "10")),
+    burst=int(os.environ.get("AOC_BURST", "10")))
+
+
+if __name__ == "__main__":
+    raise Exception("This is just a module!")
@@ -0,0 +1,105 @@
+import datetime
+import pytz
+
+# AoC releases the puzzles at midnight in this timezone.
+TZ = pytz.timezone('America/New_York')
+
+# AoC asks not to fetch a leaderboard more often than this.
+AOC_MIN_INTERVAL = datetime.timedelta(minutes=15)
+# A board that has been idle for some time is due again after this share of the idle time.
+IDLE_FACTOR = 0.25
+# Upper bounds of the refresh interval, while the event runs (1-25 December) and otherwise.
+MAX_LIVE_INTERVAL = datetime.timedelta(days=1)
+MAX_INTERVAL = datetime.timedelta(weeks=4)
+# Generation records are indexed on next_due, partitioned in buckets of this many seconds.
+DUE_BUCKET_SECONDS = 7 * 24 * 3600
+
+
+def event_live(year: int, now: datetime.datetime) -> bool:
+    return now.year == int(year) and now.month == 12 and now.day <= 25
+
+
+def min_interval(year: int, now: datetime.datetime) -> datetime.timedelta:
+    """
+    The shortest time between two fetches of a board/year from AoC, never below AOC_MIN_INTERVAL.
+    """
+    if int(year) != now.year:
+        return datetime.timedelta(weeks=2)
+    elif now.month != 12:
+        return datetime.timedelta(weeks=2)
+    elif now.day > 25:
+        return datetime.timedelta(hours=8)
+    elif now.hour >= 3:
+        return datetime.timedelta(hours=1)
+    return AOC_MIN_INTERVAL
+
+
+def is_fresh(fetched: int, year: int = None) -> bool:
+    """
+    Check whether board data fetched from AoC at timestamp fetched is recent enough to use instead of fetching again.
+
+    Args:
+        fetched (int): Timestamp of the fetch.
+        year (int, optional): Year of the board. Defaults to the current year.
+    """
+    now = datetime.datetime.now(tz=TZ)
+    return now.timestamp() - fetched < min_interval(year or now.year, now).total_seconds()
+
+
+def fetch_delay(last_fetch: int, now: int) -> int:
+    """
+    Seconds until a leaderboard last fetched (or claimed for a fetch) at last_fetch may be fetched again.
+
+    Returns:
+        int: 0 if it may be fetched now.
+    """
+    return max(0, int(last_fetch + AOC_MIN_INTERVAL.total_seconds() - now))
+
+
+def next_due(*, year: int, last_fetch: int, last_star: int = None, stars_gained: int = 0) -> int:
+    """
+    Compute when a board/year should be fetched and generated again.
+
+    Boards that gain stars are refreshed as often as min_interval allows.
+    Otherwise the interval grows with the time since the last star (or the
+    last puzzle release, while the event runs), up to a day while the
+    event runs and four weeks otherwise. The release of the next puzzle
+    and the start of the event are always due.
+
+    Args:
+        year (int): Year of the board.
+        last_fetch (int): Timestamp of the last generation.
+        last_star (int, optional): Latest last_star_ts of the members, None if unknown.
+        stars_gained (int, optional): Stars gained since the generation before. Defaults to 0.
+
+    Returns:
+        int: Timestamp when the board is due.
+    """
+    now = datetime.datetime.fromtimestamp(last_fetch, tz=TZ)
+    year = int(year)
+    live = event_live(year, now)
+    interval = min_interval(year, now)
+    if last_star is not None and not stars_gained:
+        active = last_star
+        if live:
+            active = max(active, int(TZ.localize(datetime.datetime(year, 12, now.day)).timestamp()))
+        idle = datetime.timedelta(seconds=max(0, last_fetch - active) * IDLE_FACTOR)
+        interval = min(max(interval, idle), MAX_LIVE_INTERVAL if live else MAX_INTERVAL)
+
+    due = int((now + interval).timestamp())
+    if live and now.day < 25:
+        due = min(due, int(TZ.localize(datetime.datetime(year, 12, now.day + 1)).timestamp()))
+    elif year == now.year and now.month != 12:
+        due = min(due, int(TZ.localize(datetime.datetime(year, 12, 1)).timestamp()))
+    return due
+
+
+def due_bucket(timestamp: int) -> int:
+    """
+    The partition of the due index a board due at timestamp is stored in.
+    """
+    return int(timestamp) // DUE_BUCKET_SECONDS
+
+
+if __name__ == "__main__":
+    raise Exception("This is just a module!")
@@ -3,8 +3,14 @@ import os
 import json
 import logging
 import datetime
-import pytz
-from typing import Dict
+import random
+import time
+import concurrent.futures
+import scheduling
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from typing import Dict, List
 
 DEFAULT_LOGLEVEL = logging.DEBUG
 debuglevel = os.environ.get("debug", "")
@@ -30,6 +36,8 @@ handler = logging.StreamHandler()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+dynamodb = boto3.resource('dynamodb')
+
 config_table_name = os.environ.get("DDB_CONFIG", "scoreboard-boardconfig")
 config_table = boto3.resource('dynamodb').Table(config_table_name)
 
@@ -38,9 +46,29 @@ nopoint_days_table = boto3.resource('dynamodb').Table(nopoint_days_table_name)
 
 timestamps_table_name = os.environ.get("DDB_TIMESTAMPS", "scoreboard-timestamps")
 timestamps_table = boto3.resource('dynamodb').Table(timestamps_table_name)
+# Index of timestamps_table on due_bucket/next_due, see scheduling.due_bucket.
+due_index_name = os.environ.get("DDB_TIMESTAMPS_DUE_INDEX", "due")
+# Records due longer ago than this are left to the daily reconciliation.
+due_lookback = int(os.environ.get("DUE_LOOKBACK_DAYS", "35")) * 24 * 3600
+# Item of timestamps_table marking that all records have a next_due, see backfill_due.
+BACKFILL_MARKER = "backfill|next_due"
+backfilled = False
 
 queue_name = os.environ.get('SQS_GENERATOR', "scoreboard-generator_queue")
-queue = boto3.resource('sqs').get_queue_by_name(QueueName=queue_name)
+cold_queue_name = os.environ.get('SQS_GENERATOR_COLD', "scoreboard-generator_queue_cold")
+# Generation lanes, see lane()
+queues = {
+    "hot": boto3.resource('sqs').get_queue_by_name(QueueName=queue_name),
+    "cold": boto3.resource('sqs').get_queue_by_name(QueueName=cold_queue_name)}
+# Boards with a star within this period are generated in the hot lane, whatever the year.
+hot_active_period = int(os.environ.get("HOT_ACTIVE_HOURS", "24")) * 3600
+
+# SQS accepts at most 10 entries per batch.
+SQS_BATCH_SIZE = 10
+# Batches sent at the same time.
+send_workers = int(os.environ.get("SQS_SEND_WORKERS", "4"))
+# Attempts per entry before it is left for the next run (it is still due then).
+send_attempts = int(os.environ.get("SQS_SEND_ATTEMPTS", "5"))
 
 
 def sqs_message(msg: dict) -> dict:
@@ -73,107 +101,371 @@ def scan_table(table, **scan_kwargs):
         done = start_key is None
 
 
+def query_table(table, **query_kwargs):
+    done = False
+    start_key = None
+    while not done:
+        if start_key:
+            query_kwargs['ExclusiveStartKey'] = start_key
+        response = table.query(**query_kwargs)
+        items = response.get('Items', [])
+        for item in items:
+            yield item
+        start_key = response.get('LastEvaluatedKey', None)
+        done = start_key is None
+
+
+def batch_get(table, keys: List[dict]) -> list:
+    """
+    Get the items with keys from table, 100 at a time (the limit of batch_get_item).
+    Unprocessed keys are retried with a backoff.
+    """
+    items = []
+    for i in range(0, len(keys), 100):
+        request = {table.name: {'Keys': keys[i:i + 100]}}
+        attempt = 0
+        while request:
+            if attempt:
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+            response = dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response['Responses'].get(table.name, []))
+            request = response.get('UnprocessedKeys')
+            attempt += 1
+    return items
+
+
 def get_timestamps() -> dict:
     """
-    Fetch the timestamps of the generated files and
-    return in map(<year|boardid> -> timestamp)
+    Fetch the generation records (timestamp of the generated files, activity
+    and when the board is due) and return in map(<year|boardid> -> record)
 
     Returns:
-        dict: Dictionary mapping <year>|<boardid> -> timestamp
+        dict: Dictionary mapping <year>|<boardid> -> record
     """
     result = {}
     for item in scan_table(timestamps_table):
-        result[item['id']] = item['lastgen']
+        result[item['id']] = item
+    return result
+
+
+def get_due_records(now: int) -> dict:
+    """
+    Fetch the generation records that are due from the due index of the timestamps table.
+
+    Args:
+        now (int): Records with a next_due up to now are due
+
+    Returns:
+        dict: Dictionary mapping <year>|<boardid> -> record
+    """
+    result = {}
+    for bucket in range(scheduling.due_bucket(now - due_lookback), scheduling.due_bucket(now) + 1):
+        for item in query_table(
+                timestamps_table,
+                IndexName=due_index_name,
+                KeyConditionExpression=Key('due_bucket').eq(bucket) & Key('next_due').lte(now)):
+            result[item['id']] = item
     return result
 
 
-def get_nopoint_days() -> dict:
-    return {item['id']: list(map(int, item['no_points'])) for item in scan_table(nopoint_days_table)}
+def get_configs(boardids) -> dict:
+    """
+    Returns:
+        dict: Dictionary mapping <boardid> -> config
+    """
+    items = batch_get(config_table, [{'id': _} for _ in set(boardids)])
+    return {item['id']: item['config'] for item in items if item.get('config') is not None}
+
+
+def get_nopoint_days(years) -> dict:
+    items = batch_get(nopoint_days_table, [{'id': _} for _ in set(years)])
+    return {item['id']: list(map(int, item['no_points'])) for item in items}
 
 
 def should_send_message(
-        last_timestamp: int,
+        record: dict,
         msg: dict) -> bool:
     """
     Determine of the message should be sent.
 
-    The message is sent of there is no prior record or if the
-    age of the last generated file is greater than the cool off period.
-
-    The cool off period is:
-    * 2 weeks if the requsted year is not current year
-    * 2 weeks if the current month is not December
-    * 8 hours if the current day is after the 25th
-    * 1 hours if the current time is more than 01:00 (America/New York)
-    * 2 minutes if the current time is earlier than 01:00 (America/New York)
+    The message is sent of there is no prior record or if the board is due,
+    see scheduling.next_due. Records written before boards were scheduled
+    are due after scheduling.min_interval.
 
     Args:
-        last_timestamp (int): Latest time file was regenerated
+        record (dict): Generation record of the board/year, None if there is none
         msg (dict): msg with boardinfo
 
     Returns:
         bool: True if the board requires regeneration
     """
-    if not last_timestamp:
+    if not record:
         return True
 
-    tz = pytz.timezone('America/New_York')
-    last_time = datetime.datetime.fromtimestamp(last_timestamp, tz=tz)
-    now = datetime.datetime.now(tz=tz)
-    age = now - last_time
-
-    if msg['year'] != now.year:
-        cool_off = datetime.timedelta(weeks=2)
-    elif now.month != 12:
-        cool_off = datetime.timedelta(weeks=2)
-    elif now.day > 25:
-        cool_off = datetime.timedelta(hours=8)
-    elif now.hour >= 3:
-        cool_off = datetime.timedelta(hours=1)
-    else:
-        cool_off = datetime.timedelta(minutes=2)
+    due = record_due(record, msg['year'])
+    now = int(datetime.datetime.now().timestamp())
 
-    # cool_off = datetime.timedelta(minutes=2)
+    logger.debug(f"{msg['year']}|{msg['boardid']}: last_time: {record['lastgen']} due: {due}. Regenerate: {now >= due}")  # noqa e501
 
-    logger.debug(f"{msg['year']}|{msg['boardid']}: last_time: {last_time} age: {age}, cool_off: {cool_off}. Regenerate: {age > cool_off}")  # noqa e501
+    return now >= due
 
-    return age.total_seconds() > cool_off.total_seconds()
 
+def record_due(record: dict, year: str) -> int:
+    """
+    When the board/year of record is due. Records written before boards
+    were scheduled have no next_due and are due after scheduling.min_interval.
+    """
+    if 'next_due' in record:
+        return int(record['next_due'])
+    return scheduling.next_due(year=int(year), last_fetch=int(record['lastgen']))
+
+
+def backfill_due(timestamps: dict) -> int:
+    """
+    Write next_due and due_bucket to the records written before boards were
+    scheduled, so the due index finds them, and mark the backfill as done.
+
+    Args:
+        timestamps (dict): Dictionary mapping <year>|<boardid> -> record, see get_timestamps
+
+    Returns:
+        int: Number of records updated
+    """
+    global backfilled
+    updated = 0
+    for key, record in timestamps.items():
+        if 'next_due' in record or 'lastgen' not in record:
+            continue
+        due = record_due(record, key.split('|', 1)[0])
+        try:
+            timestamps_table.update_item(
+                Key={'id': key},
+                UpdateExpression="SET next_due = :due, due_bucket = :bucket",
+                ConditionExpression="attribute_not_exists(next_due)",
+                ExpressionAttributeValues={':due': due, ':bucket': scheduling.due_bucket(due)})
+            updated += 1
+        except ClientError as e:
+            # ConditionalCheckFailedException: generated since it was read.
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+    timestamps_table.put_item(Item={'id': BACKFILL_MARKER, 'done': int(datetime.datetime.now().timestamp())})
+    backfilled = True
+    logger.info(f"Backfilled next_due of {updated} records")
+    return updated
+
+
+def is_backfilled() -> bool:
+    global backfilled
+    if not backfilled:
+        backfilled = 'Item' in timestamps_table.get_item(Key={'id': BACKFILL_MARKER})
+    return backfilled
+
+
+def lane(year: str, record: dict) -> str:
+    """
+    Determine the lane (queue) a board/year is generated in.
+
+    The hot lane is for boards people are watching: the current year in
+    December and boards with a star within hot_active_period. Everything
+    else (historical years, backfills of new boards) goes to the cold lane,
+    so it never delays the hot lane.
+
+    Args:
+        year (str): Year of the board
+        record (dict): Generation record of the board/year, None if there is none
+
+    Returns:
+        str: "hot" or "cold"
+    """
+    now = datetime.datetime.now(tz=scheduling.TZ)
+    if int(year) == now.year and now.month == 12:
+        return "hot"
+    if record and int(record.get('last_star', 0)) > now.timestamp() - hot_active_period:
+        return "hot"
+    return "cold"
+
+
+def board_message(config: dict, year: str, record: dict, nopoint_days: dict) -> dict:
+    return {
+        'boardid': config['boardid'],
+        'sessionid': config['sessionid'],
+        'title': config['title'],
+        'year': year,
+        'uuid': config.get('uuid', config['boardid']),
+        'last_timestamp': int((record or {}).get('lastgen', -1)),
+        'nopoint_days': nopoint_days.get(year, []),
+        'lane': lane(year, record)
+    }
+
+
+def due_messages() -> List[dict]:
+    """
+    Messages for the board/years that are due according to the due index.
+    """
+    now = int(datetime.datetime.now().timestamp())
+    due = get_due_records(now)
+    keys = [_.split('|', 1) for _ in due]
+    configs = get_configs(boardid for _, boardid in keys)
+    nopoint_days = get_nopoint_days(year for year, _ in keys)
 
-def generate_messages():
-    timestamps = get_timestamps()
-    nopoint_days = get_nopoint_days()
     messages = []
+    for year, boardid in keys:
+        config = configs.get(boardid)
+        if config is None or year not in config['years']:
+            logger.debug(f"{year}|{boardid} is due but no longer configured")
+            continue
+        messages.append(board_message(config, year, due[f"{year}|{boardid}"], nopoint_days))
+    logger.info(f"{len(due)} records due, {len(messages)} boards to generate")
+    return messages
 
+
+def reconcile_messages() -> List[dict]:
+    """
+    Messages for all configured board/years that are due, including those
+    without a record in the due index (never generated, records from before
+    the index, or due longer than due_lookback ago).
+    Records from before the index are backfilled, see backfill_due.
+    """
+    timestamps = get_timestamps()
+    backfill_due(timestamps)
+    configs = []
     # read all records from config_table
-    # create and post a queue message for each record
     for item in scan_table(config_table):
         config = item.get('config')
         if config is None:
             logger.warning(f'Missing config: {item}')
             continue
+        configs.append(config)
+    nopoint_days = get_nopoint_days(year for config in configs for year in config['years'])
 
+    messages = []
+    for config in configs:
         for year in config['years']:
-            msg = {
-                'boardid': config['boardid'],
-                'sessionid': config['sessionid'],
-                'title': config['title'],
-                'year': year,
-                'uuid': config.get('uuid', config['boardid']),
-                'last_timestamp': int(timestamps.get(f"{year}|{config['boardid']}", -1)),
-                'nopoint_days': nopoint_days.get(year, [])
-            }
+            record = timestamps.get(f"{year}|{config['boardid']}")
+            msg = board_message(config, year, record, nopoint_days)
+            if should_send_message(record, msg):
+                messages.append(msg)
+    return messages
 
-            if should_send_message(msg['last_timestamp'], msg):
-                messages.append(sqs_message(msg))
 
-    if messages:
-        queue.send_messages(Entries=messages)
-    return len(messages)
+def added_board_messages(records: list) -> List[dict]:
+    """
+    Messages for the board/years added to the board configuration,
+    records are the events of the boardconfig table stream.
+    """
+    deserializer = TypeDeserializer()
+
+    def config(image):
+        if not image or 'config' not in image:
+            return None
+        return deserializer.deserialize(image['config'])
+
+    added = []
+    for record in records:
+        if record.get('eventName') not in ('INSERT', 'MODIFY'):
+            continue
+        new = config(record.get('dynamodb', {}).get('NewImage'))
+        if new is None:
+            continue
+        old = config(record.get('dynamodb', {}).get('OldImage')) or {'years': []}
+        added.extend((new, year) for year in new['years'] if year not in old['years'])
+    nopoint_days = get_nopoint_days(year for _, year in added)
+    return [board_message(config, year, None, nopoint_days) for config, year in added]
+
+
+def send_batch(queue, entries: List[dict]) -> List[dict]:
+    """
+    Send up to SQS_BATCH_SIZE entries to queue, retrying the entries that failed with a backoff.
+
+    Returns:
+        List[dict]: The entries that could not be sent
+    """
+    rejected = []
+    for attempt in range(send_attempts):
+        if attempt:
+            time.sleep(min(0.1 * 2 ** attempt, 2) * random.uniform(0.5, 1))
+        try:
+            # The client is thread safe, the queue resource is not.
+            response = queue.meta.client.send_message_batch(QueueUrl=queue.url, Entries=entries)
+        except Exception as e:
+            logger.warning(f"Sending {len(entries)} messages failed (attempt {attempt + 1}): {e}")
+            continue
+        failed = {_['Id']: _ for _ in response.get('Failed', [])}
+        retry = []
+        for entry in entries:
+            f = failed.get(entry['Id'])
+            if f is None:
+                continue
+            if f.get('SenderFault'):
+                logger.error(f"Message {f['Id']} rejected: {f.get('Code')} {f.get('Message')}")
+                rejected.append(entry)
+            else:
+                retry.append(entry)
+        entries = retry
+        if not entries:
+            return rejected
+        logger.warning(f"Retrying {len(entries)} messages (attempt {attempt + 1})")
+    return rejected + entries
+
+
+def send_messages(messages: List[dict]) -> int:
+    """
+    Send messages to the queue of their lane in batches of SQS_BATCH_SIZE, send_workers batches at a time.
+
+    Returns:
+        int: Number of messages sent
+    """
+    # Ids must be unique within a batch
+    lanes = {}
+    for msg in messages:
+        entry = sqs_message(msg)
+        lanes.setdefault(msg['lane'], {})[entry['Id']] = entry
+    if not lanes:
+        return 0
+    start = time.perf_counter()
+    batches = []
+    for name, entries in lanes.items():
+        entries = list(entries.values())
+        batches.extend((queues[name], entries[i:i + SQS_BATCH_SIZE]) for i in range(0, len(entries), SQS_BATCH_SIZE))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=send_workers) as executor:
+        failed = [_ for unsent in executor.map(lambda batch: send_batch(*batch), batches) for _ in unsent]
+    elapsed = time.perf_counter() - start
+    total = sum(len(_) for _ in lanes.values())
+    sent = total - len(failed)
+    per_lane = ", ".join(f"{name}: {len(_)}" for name, _ in sorted(lanes.items()))
+    logger.info(
+        f"Enqueued {sent}/{total} messages ({per_lane}) in {len(batches)} batches, "
+        f"{elapsed:.2f}s ({sent / elapsed:.0f} messages/s)")
+    if failed:
+        logger.error(f"Could not enqueue {', '.join(_['Id'] for _ in failed)}")
+    return sent
+
+
+def generate_messages(event: dict = None) -> int:
+    """
+    Send messages for the boards to generate.
+
+    Args:
+        event (dict, optional): The boardconfig table stream event: send the board/years
+        that were added. {"reconcile": true}: go through all configured boards. Otherwise
+        send the board/years that are due, after going through all configured boards
+        once if the records have not been backfilled yet. Defaults to None.
+
+    Returns:
+        int: Number of messages sent
+    """
+    event = event or {}
+    if event.get('Records'):
+        messages = added_board_messages(event['Records'])
+    elif event.get('reconcile') or not is_backfilled():
+        messages = reconcile_messages()
+    else:
+        messages = due_messages()
+    return send_messages(messages)
 
 
 def main(event, context):
-    n = generate_messages()
+    n = generate_messages(event)
     logger.info(f'Sent {n} messages.')
 
 
@@ -6,7 +6,8 @@ from aws_cdk import (
     aws_s3,
     aws_s3_deployment,
     aws_lambda,
-    aws_events
+    aws_events,
+    aws_events_targets
 )
 import aws
 import os
@@ -18,6 +19,15 @@ RETAIN = core.RemovalPolicy.RETAIN
 EPHEMERALDATA = DESTROY
 CONFIGDATA = DESTROY
 
+# The htmlgen consumers of the generator lanes (see spawner.lane):
+# SQS batch size, reserved concurrency (None: unreserved) and
+# boards generated at the same time per invocation (GENERATOR_WORKERS, in
+# GENERATOR_MODE=process if more than one).
+GENERATOR_LANES = {
+    "hot": {"batch_size": 10, "concurrency": None, "workers": 4},
+    "cold": {"batch_size": 5, "concurrency": 2, "workers": 2},
+}
+
 
 def read_token_from_file(filename: str) -> str:
     if not os.path.exists(filename):
@@ -40,6 +50,14 @@ class ScoreboardStack(core.Stack):
                 "bot": "bot/requirements.txt"
             })
 
+        # Code shared between the functions (the AoC http client)
+        shared_layer = aws_lambda.LayerVersion(
+            self,
+            "shared_layer",
+            code=aws_lambda.Code.from_asset("shared"),
+            compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_8],
+            layer_version_name=aws.gen_name(self, "shared_layer"))
+
         # Create
         # * the generator function
         # * Namemap-table
@@ -48,12 +66,22 @@ class ScoreboardStack(core.Stack):
         # * Datacache-bucket
         #   * Allow generator to read and write to bucket
 
-        htmlgen = aws.Function(
-            self,
-            "htmlgen",
-            layers=layer.layers,
-            timeout=core.Duration.seconds(20),
-            memory_size=1024)
+        # One function per lane, the hot lane keeps the original names.
+        generators = {}
+        for lane, tuning in GENERATOR_LANES.items():
+            generators[lane] = aws.Function(
+                self,
+                "htmlgen" if lane == "hot" else f"htmlgen_{lane}",
+                code=aws_lambda.Code.from_asset("htmlgen"),
+                handler="htmlgen.main",
+                layers=[*layer.layers, shared_layer],
+                timeout=core.Duration.seconds(20),
+                memory_size=1024,
+                reserved_concurrent_executions=tuning["concurrency"])
+            generators[lane].add_environment("GENERATOR_LANE", lane)
+            generators[lane].add_environment("GENERATOR_WORKERS", str(tuning["workers"]))
+            # Lanes with several workers generate their boards in processes of their own.
+            generators[lane].add_environment("GENERATOR_MODE", "process" if tuning["workers"] > 1 else "async")
 
         # id: str (boardid), name: str (username), value: str (replacement value)
         namemap = aws.Table(
@@ -63,7 +91,6 @@ class ScoreboardStack(core.Stack):
                 name='name',
                 type=aws_dynamodb.AttributeType.STRING),
             removal_policy=CONFIGDATA)
-        namemap.grant_read_data(htmlgen)
 
         no_point_days = aws.Table(
             self,
@@ -83,22 +110,25 @@ class ScoreboardStack(core.Stack):
         parse_globals = aws.Function(
             self,
             "parse_globals",
-            layers=layer.layers,
+            layers=[*layer.layers, shared_layer],
             timeout=core.Duration.seconds(20),
             memory_size=1024)
         parse_globals.add_environment("DDB_GLOBALSCORES", globalscores.table_name)
         globalscores.grant_read_write_data(parse_globals)
-        globalscores.grant_read_data(htmlgen)
 
         timestamps = aws.Table(
             self,
             "timestamps",
             removal_policy=EPHEMERALDATA)
-        htmlgen.add_environment("DDB_TIMESTAMPS", timestamps.table_name)
-        timestamps.grant_write_data(htmlgen)
+        # Lets the spawner read only the board/years that are due, see scheduling.due_bucket
+        timestamps.add_global_secondary_index(
+            index_name="due",
+            partition_key=aws_dynamodb.Attribute(name="due_bucket", type=aws_dynamodb.AttributeType.NUMBER),
+            sort_key=aws_dynamodb.Attribute(name="next_due", type=aws_dynamodb.AttributeType.NUMBER),
+            projection_type=aws_dynamodb.ProjectionType.INCLUDE,
+            non_key_attributes=["lastgen", "last_star"])
 
         datacache = aws.Bucket(self, "datacache")
-        datacache.grant_read_write(htmlgen)
 
         htmlbucket = aws.Bucket(
             self,
@@ -117,10 +147,6 @@ class ScoreboardStack(core.Stack):
                 self,
                 f"{id}_bucketurl",
                 value=f"BUCKET_URL={htmlbucket.bucket_website_url}")
-        htmlbucket.grant_read_write(htmlgen)
-        htmlgen.add_environment("S3_DATACACHE", datacache.bucket_name)
-        htmlgen.add_environment("S3_HTML", htmlbucket.bucket_name)
-        htmlgen.add_environment("DDB_NAMEMAP", namemap.table_name)
 
         aws_s3_deployment.BucketDeployment(
             self, "StaticHtml",
@@ -132,12 +158,13 @@ class ScoreboardStack(core.Stack):
         # * spawner function
         # * boardconfig-table
         #   * allow spawner to read from boardconfig-table
-        # * generator_queue
-        #   allow spawner to post messages to queue
+        # * generator queues (hot and cold lane)
+        #   allow spawner to post messages to the queues
         spawner = aws.Function(
             self,
             "spawner",
-            layers=layer.layers)
+            layers=[*layer.layers, shared_layer],
+            timeout=core.Duration.seconds(20))
         boardconfig = aws.Table(
             self,
             "boardconfig",
@@ -157,15 +184,40 @@ class ScoreboardStack(core.Stack):
         boarddeletions.add_environment("S3_HTML", htmlbucket.bucket_name)
         htmlbucket.grant_read_write(boarddeletions)
 
-        generator_queue = aws.Queue(self, "generator_queue")
-        generator_queue.grant_send_messages(spawner)
-        spawner.add_environment("SQS_GENERATOR", generator_queue.queue_name)
+        generator_queues = {
+            "hot": aws.Queue(self, "generator_queue"),
+            "cold": aws.Queue(self, "generator_queue_cold")}
+        for queue in generator_queues.values():
+            queue.grant_send_messages(spawner)
+        spawner.add_environment("SQS_GENERATOR", generator_queues["hot"].queue_name)
+        spawner.add_environment("SQS_GENERATOR_COLD", generator_queues["cold"].queue_name)
         spawner.add_environment("DDB_TIMESTAMPS", timestamps.table_name)
-        timestamps.grant_read_data(spawner)
+        spawner.add_environment("DDB_TIMESTAMPS_DUE_INDEX", "due")
+        # The spawner backfills next_due of old records, see spawner.backfill_due
+        timestamps.grant_read_write_data(spawner)
+        # New boards/years are sent right away
+        spawner.add_event_source(aws_lambda_event_sources.DynamoEventSource(
+            boardconfig,
+            starting_position=aws_lambda.StartingPosition.LATEST
+        ))
 
-        # Connect the generator_queue to the htmlgen-function
-        event_source = aws_lambda_event_sources.SqsEventSource(generator_queue, batch_size=10)
-        htmlgen.add_event_source(event_source)
+        # Connect the generator queues to the htmlgen-function of their lane
+        for lane, htmlgen in generators.items():
+            namemap.grant_read_data(htmlgen)
+            globalscores.grant_read_data(htmlgen)
+            timestamps.grant_read_write_data(htmlgen)
+            datacache.grant_read_write(htmlgen)
+            htmlbucket.grant_read_write(htmlgen)
+            htmlgen.add_environment("DDB_TIMESTAMPS", timestamps.table_name)
+            htmlgen.add_environment("S3_DATACACHE", datacache.bucket_name)
+            htmlgen.add_environment("S3_HTML", htmlbucket.bucket_name)
+            htmlgen.add_environment("DDB_NAMEMAP", namemap.table_name)
+            # Boards that may not be fetched from AoC yet are sent back with a delay.
+            generator_queues[lane].grant_send_messages(htmlgen)
+            htmlgen.add_environment("SQS_GENERATOR", generator_queues[lane].queue_name)
+            htmlgen.add_event_source(aws_lambda_event_sources.SqsEventSource(
+                generator_queues[lane],
+                batch_size=GENERATOR_LANES[lane]["batch_size"]))
 
         # Admin API
         adminhandler = aws.Function(self, "adminhandler")
@@ -202,6 +254,14 @@ class ScoreboardStack(core.Stack):
         #     schedule=aws_events.Schedule.cron(minute="*", hour="*", week_day="2", month="FEB"),
         #     target=spawner)
 
+        aws.Rule(
+            self,
+            "Reconcile",
+            description="Every day, go through all boards (not only those in the due index)",
+            schedule=aws_events.Schedule.cron(minute="30", hour="3"),
+            targets=[aws_events_targets.LambdaFunction(
+                spawner,
+                event=aws_events.RuleTargetInput.from_object({"reconcile": True}))])
         aws.Rule(
             self,
             "RestOfYear",
@@ -0,0 +1,32 @@
+"""
+Helpers of aocgen that do not talk to AWS.
+
+    python -m pytest tests
+"""
+import os
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "htmlgen"), str(ROOT / "shared" / "python")]
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from aocgen import ComputedBoards  # noqa E402
+
+
+def test_computed_boards_evicts_least_recently_used():
+    boards = ComputedBoards(2)
+    boards.put(("a", "2020"), "board a")
+    boards.put(("b", "2020"), "board b")
+    assert boards.get(("a", "2020")) == "board a"
+    boards.put(("c", "2020"), "board c")
+    assert boards.get(("b", "2020")) is None
+    assert boards.get(("a", "2020")) == "board a"
+    assert boards.get(("c", "2020")) == "board c"
+
+
+def test_computed_boards_replaces_board():
+    boards = ComputedBoards(1)
+    boards.put(("a", "2020"), "old")
+    boards.put(("a", "2020"), "new")
+    assert boards.get(("a", "2020")) == "new"
@@ -0,0 +1,71 @@
+"""
+The numpy engine must compute the same statistics as the python engine.
+
+    python -m pytest tests
+"""
+import os
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "htmlgen"), str(ROOT / "shared" / "python"), str(ROOT / "benchmark")]
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import scoreboard  # noqa E402
+from jsextractor import TWO_STAR_TABLES, jsextractor  # noqa E402
+from scoreboard import LeaderBoard  # noqa E402
+from synthetic import make_leaderboard  # noqa E402
+
+pytestmark = pytest.mark.skipif(scoreboard.columnar is None, reason="numpy is not available")
+
+STAR_ATTRS = [column for column, _ in TWO_STAR_TABLES.values()] + ['completiontime']
+DAY_ATTRS = ['timetocompletestar2', 'star2pos']
+
+
+def compute(score: dict, engine: str, highestday: int, nopoint_days: list) -> LeaderBoard:
+    board = LeaderBoard(
+        title="Engines",
+        score=score,
+        year="2020",
+        highestday=highestday,
+        namemap={},
+        uuid="engines",
+        global_scores={},
+        nopoint_days=nopoint_days,
+        engine=engine)
+    board.post_process_stats()
+    return board
+
+
+def statistics(board: LeaderBoard) -> dict:
+    return {
+        p.id: (
+            p.totalscore, p.localscore, p.position, p.pendingpoints, p.accumulatedtobiiscoretotal,
+            {attr: board.star_values(p, attr) for attr in STAR_ATTRS},
+            {attr: board.day_values(p, attr) for attr in DAY_ATTRS})
+        for p in board.players}
+
+
+def board_stars(board: LeaderBoard) -> list:
+    return [
+        (star.topscore, star.besttime, star.starsawarded)
+        for day in range(1, board.highestday + 1) for star in board.days[day]]
+
+
+@pytest.mark.parametrize("highestday", [1, 7, 25])
+@pytest.mark.parametrize("kwargs", [
+    {"members": 80, "seed": 1},
+    {"members": 80, "seed": 2, "ties": 0.3},
+    {"members": 30, "seed": 3, "idle": 0.6, "second_star": 0.5},
+])
+def test_engines_compute_the_same_statistics(highestday, kwargs):
+    score = make_leaderboard(days=highestday, **kwargs)
+    nopoint_days = [1] if kwargs["seed"] == 3 else []
+    python = compute(score, "python", highestday, nopoint_days)
+    numpy = compute(score, "numpy", highestday, nopoint_days)
+    assert numpy.columns is not None
+    assert statistics(numpy) == statistics(python)
+    assert board_stars(numpy) == board_stars(python)
+    assert jsextractor(numpy, {}).artifacts() == jsextractor(python, {}).artifacts()
@@ -0,0 +1,63 @@
+"""
+Global leaderboard points of LeaderBoard.update_global_scores.
+
+    python -m pytest tests
+"""
+import os
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "htmlgen"), str(ROOT / "shared" / "python")]
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from scoreboard import LeaderBoard, global_score_index  # noqa E402
+from test_ranking import ENGINES, YEAR, member  # noqa E402
+
+# map <day> -> [[names star 1], [names star 2]], as in the globalscores table (days as stored, Decimal or str).
+SCORES = {
+    1: [["Player 1", "someone", "Player 2"], ["someone", "Player 1"]],
+    "2": [["(anonymous user #3)", "3"], []],
+    3: [["Player 1"], ["Player 1"]],
+}
+
+
+def test_global_score_index():
+    index = global_score_index(SCORES)
+    assert index["Player 1"] == {(1, 0): 1, (1, 1): 2, (3, 0): 1, (3, 1): 1}
+    assert index["Player 2"] == {(1, 0): 3}
+    assert index["3"] == {(2, 0): 2}
+    assert global_score_index({}) == {}
+
+
+def test_global_score_index_keeps_first_position():
+    assert global_score_index({1: [["a", "a"], []]}) == {"a": {(1, 0): 1}}
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("with_index", [True, False])
+def test_points_are_101_minus_position(engine, with_index):
+    members = [member(1, {1: [10, 20], 3: [10, 20]}), member(2, {1: [30]}), member(3, {2: [5]})]
+    global_scores = {"scores": SCORES}
+    if with_index:
+        global_scores["index"] = global_score_index(SCORES)
+    board = LeaderBoard(
+        title="Global",
+        score={"owner_id": 1, "event": str(YEAR), "members": {str(_["id"]): _ for _ in members}},
+        year=str(YEAR),
+        highestday=2,
+        namemap={"Player 2": "Bob"},
+        uuid="global",
+        global_scores=global_scores,
+        nopoint_days=[],
+        engine=engine)
+    board.update_global_scores()
+    board.post_process_stats()
+    points = {p.id: board.star_values(p, "globalscore") for p in board.players}
+    assert points[1] == [[100, 99], [0, 0]]
+    # Found by AoC name although the namemap renamed the player.
+    assert points[2] == [[98, 0], [0, 0]]
+    # Anonymous players are found by id.
+    assert points[3] == [[0, 0], [99, 0]]
@@ -0,0 +1,127 @@
+"""
+Tied rankings of LeaderBoard.post_process_stats, for both engines.
+
+    python -m pytest tests
+"""
+import datetime
+import itertools
+import os
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "htmlgen"), str(ROOT / "shared" / "python")]
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import scoreboard  # noqa E402
+from scoreboard import LeaderBoard, competition_ranks  # noqa E402
+
+YEAR = 2020
+ENGINES = ["python"] + (["numpy"] if scoreboard.columnar is not None else [])
+
+
+def publish_time(day: int) -> int:
+    return int(datetime.datetime(year=YEAR, month=12, day=day, hour=6).timestamp())
+
+
+def member(memberid: int, solved: dict) -> dict:
+    """
+    solved: map <day> -> [seconds after publish for star 1, (star 2)]
+    """
+    levels = {
+        str(day): {str(star + 1): {"get_star_ts": publish_time(day) + t} for star, t in enumerate(times)}
+        for day, times in solved.items()}
+    return {
+        "id": memberid,
+        "name": f"Player {memberid}",
+        "local_score": 0,
+        "global_score": 0,
+        "stars": sum(len(_) for _ in solved.values()),
+        "last_star_ts": max([s["get_star_ts"] for level in levels.values() for s in level.values()], default=0),
+        "completion_day_level": levels,
+    }
+
+
+def make_board(members: list, engine: str, highestday: int = 2) -> LeaderBoard:
+    board = LeaderBoard(
+        title="Ties",
+        score={"owner_id": 1, "event": str(YEAR), "members": {str(_["id"]): _ for _ in members}},
+        year=str(YEAR),
+        highestday=highestday,
+        namemap={},
+        uuid="ties",
+        global_scores={"scores": {}},
+        nopoint_days=[],
+        engine=engine)
+    board.post_process_stats()
+    return board
+
+
+# 1 and 2 solve both stars of day 1 in the same second, 3 is faster, 4 does not solve anything.
+# On day 2 star 1, 1 and 2 tie again, so they stay tied on accumulated score.
+TIED = [
+    member(1, {1: [100, 200], 2: [50]}),
+    member(2, {1: [100, 200], 2: [50]}),
+    member(3, {1: [10, 20]}),
+    member(4, {}),
+]
+
+
+def ranks(board: LeaderBoard, attr: str) -> dict:
+    return {p.id: board.star_values(p, attr) for p in board.players}
+
+
+def test_competition_ranks():
+    assert competition_ranks([5, 3, 3, 1]) == {1: 0, 3: 1, 5: 3}
+    assert competition_ranks([5, 3, 3, 1], reverse=True) == {5: 0, 3: 1, 1: 3}
+    assert competition_ranks([]) == {}
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_tied_completion_shares_position(engine):
+    positions = ranks(make_board(TIED, engine), "position")
+    assert positions[3][0] == [1, 1]
+    assert positions[1][0] == [2, 2]
+    assert positions[2][0] == [2, 2]
+    assert positions[1][1][0] == positions[2][1][0] == 1
+    assert positions[4][0] == [None, None]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_tied_accumulated_score_shares_position(engine):
+    board = make_board(TIED, engine)
+    scores = ranks(board, "accumulatedscore")
+    positions = ranks(board, "accumulatedposition")
+    assert scores[1][1][0] == scores[2][1][0]
+    assert positions[1][1][0] == positions[2][1][0] == 0
+    assert positions[3][1][0] == 2
+    # Players without any score are not placed.
+    assert positions[4] == [[-1, -1], [-1, -1]]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_ties_do_not_depend_on_member_order(engine):
+    expected = None
+    for order in itertools.permutations(TIED):
+        board = make_board(list(order), engine)
+        found = {attr: ranks(board, attr) for attr in ["position", "accumulatedposition", "accumulatedscore"]}
+        assert all(_ is not None for values in found["accumulatedposition"].values() for day in values for _ in day)
+        expected = expected or found
+        assert found == expected
+
+
+def test_running_values_read_through_player_days():
+    board = make_board(TIED, "python")
+    allocated = {p.id: set(p.days) for p in board.players}
+    for p in board.players:
+        for d in range(1, board.highestday + 1):
+            for star in range(2):
+                for attr in scoreboard.RUNNING_STAR:
+                    assert getattr(p[d][star], attr) == board.star_values(p, attr)[d-1][star]
+        assert [p[d].star2pos for d in range(1, board.highestday + 1)] == board.day_values(p, 'star2pos')
+    # Reading untouched days does not allocate them.
+    assert {p.id: set(p.days) for p in board.players} == allocated
+    with pytest.raises(AttributeError):
+        board.players[0][1][0].accumulatedscore = 0
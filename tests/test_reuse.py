@@ -0,0 +1,94 @@
+"""
+Statistics computed from an earlier snapshot of the board must equal a full recompute, for both engines.
+
+    python -m pytest tests
+"""
+import copy
+import os
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "htmlgen"), str(ROOT / "shared" / "python"), str(ROOT / "benchmark")]
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import scoreboard  # noqa E402
+from jsextractor import jsextractor  # noqa E402
+from scoreboard import LeaderBoard  # noqa E402
+from synthetic import make_leaderboard  # noqa E402
+
+ENGINES = ["python"] + (["numpy"] if scoreboard.columnar is not None else [])
+DAYS = 12
+
+
+def earlier(score: dict, firstday: int) -> dict:
+    """
+    The board as it was before every other member solved anything on firstday or later.
+    """
+    score = copy.deepcopy(score)
+    for i, member in enumerate(score["members"].values()):
+        if i % 2:
+            levels = member["completion_day_level"]
+            for day in [_ for _ in levels if int(_) >= firstday]:
+                del levels[day]
+    return score
+
+
+def compute(score: dict, engine: str, highestday: int = DAYS, previous: LeaderBoard = None) -> LeaderBoard:
+    board = LeaderBoard(
+        title="Reuse",
+        score=score,
+        year="2020",
+        highestday=highestday,
+        namemap={},
+        uuid="reuse",
+        global_scores={},
+        nopoint_days=[3],
+        engine=engine)
+    board.post_process_stats(previous)
+    return board
+
+
+def output(board: LeaderBoard) -> tuple:
+    players = [(_.id, _.totalscore, _.position, _.pendingpoints, _.accumulatedtobiiscoretotal) for _ in board.players]
+    return players, jsextractor(board, {}).artifacts()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("firstday", [2, 7, DAYS])
+def test_changed_days_are_recomputed(engine, firstday):
+    score = make_leaderboard(members=60, days=DAYS, seed=firstday)
+    previous = compute(earlier(score, firstday), engine)
+    board = LeaderBoard(
+        title="Reuse", score=score, year="2020", highestday=DAYS, namemap={}, uuid="reuse",
+        global_scores={}, nopoint_days=[3], engine=engine)
+    assert board.first_changed_day(previous) == firstday
+
+    assert output(compute(score, engine, previous=previous)) == output(compute(score, engine))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_new_day_is_computed(engine):
+    score = make_leaderboard(members=60, days=DAYS, seed=1)
+    previous = compute(earlier(score, DAYS), engine, highestday=DAYS - 1)
+    assert output(compute(score, engine, previous=previous)) == output(compute(score, engine))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_unchanged_board_is_reused(engine):
+    score = make_leaderboard(members=60, days=DAYS, seed=2)
+    previous = compute(score, engine)
+    assert output(compute(score, engine, previous=previous)) == output(compute(score, engine))
+
+
+def test_other_engine_is_not_reused():
+    if "numpy" not in ENGINES:
+        pytest.skip("numpy is not available")
+    score = make_leaderboard(members=20, days=DAYS, seed=3)
+    previous = compute(score, "python")
+    board = LeaderBoard(
+        title="Reuse", score=score, year="2020", highestday=DAYS, namemap={}, uuid="reuse",
+        global_scores={}, nopoint_days=[3], engine="numpy")
+    assert board.first_changed_day(previous) == 1
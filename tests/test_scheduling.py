@@ -0,0 +1,96 @@
+"""
+Refresh scheduling of board/years.
+
+    python -m pytest tests
+"""
+import datetime
+import os
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "shared" / "python")]
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import scheduling  # noqa E402
+from scheduling import DUE_BUCKET_SECONDS, TZ, due_bucket, fetch_delay, next_due  # noqa E402
+
+HOUR = 3600
+
+
+def ts(*args) -> int:
+    """
+    Timestamp of a time in the AoC timezone.
+    """
+    return int(TZ.localize(datetime.datetime(*args)).timestamp())
+
+
+@pytest.mark.parametrize("fetched, expected", [
+    # Right after the release, as often as AoC allows.
+    (ts(2020, 12, 10, 0, 30), ts(2020, 12, 10, 0, 45)),
+    # Later in the day once an hour.
+    (ts(2020, 12, 10, 12), ts(2020, 12, 10, 13)),
+    # After the event three times a day.
+    (ts(2020, 12, 28, 12), ts(2020, 12, 28, 20)),
+])
+def test_active_board_is_due_after_min_interval(fetched, expected):
+    assert next_due(year=2020, last_fetch=fetched, last_star=fetched - 60, stars_gained=3) == expected
+
+
+def test_unknown_activity_is_due_after_min_interval():
+    fetched = ts(2020, 12, 10, 12)
+    assert next_due(year=2020, last_fetch=fetched) == fetched + HOUR
+
+
+def test_idle_board_backs_off_from_the_release():
+    # The last star is older than today's release, idle since midnight: 12h * IDLE_FACTOR.
+    fetched = ts(2020, 12, 10, 12)
+    assert next_due(year=2020, last_fetch=fetched, last_star=ts(2020, 12, 9, 8)) == fetched + 3 * HOUR
+
+
+def test_idle_board_is_due_at_the_next_release():
+    assert next_due(year=2020, last_fetch=ts(2020, 12, 10, 22), last_star=ts(2020, 12, 1, 8)) == ts(2020, 12, 11)
+
+
+def test_last_day_is_not_capped_by_a_release():
+    fetched = ts(2020, 12, 25, 20)
+    # Idle since the last star at 00:30, 19.5h * IDLE_FACTOR.
+    assert next_due(year=2020, last_fetch=fetched, last_star=ts(2020, 12, 25, 0, 30)) == fetched + int(19.5 * HOUR / 4)
+
+
+def test_old_year_backs_off_to_max_interval():
+    fetched = ts(2023, 6, 1)
+    due = next_due(year=2019, last_fetch=fetched, last_star=ts(2019, 12, 30))
+    assert due == fetched + int(scheduling.MAX_INTERVAL.total_seconds())
+
+
+def test_current_year_is_due_at_the_start_of_the_event():
+    assert next_due(year=2023, last_fetch=ts(2023, 11, 25), last_star=ts(2023, 1, 1)) == ts(2023, 12, 1)
+
+
+@pytest.mark.parametrize("year", [2019, 2020])
+@pytest.mark.parametrize("hour", [1, 5, 12, 20])
+@pytest.mark.parametrize("day", [1, 10, 24, 26])
+def test_never_more_often_than_aoc_allows(year, hour, day):
+    fetched = ts(2020, 12, day, hour)
+    for last_star in [None, fetched - 60, ts(2020, 12, 1)]:
+        assert next_due(year=year, last_fetch=fetched, last_star=last_star, stars_gained=1) - fetched >= 15 * 60
+        assert next_due(year=year, last_fetch=fetched, last_star=last_star) - fetched >= 15 * 60
+
+
+def test_fetch_delay():
+    assert fetch_delay(1000, 1000) == 15 * 60
+    assert fetch_delay(1000, 1000 + 10 * 60) == 5 * 60
+    assert fetch_delay(1000, 1000 + 15 * 60) == 0
+    assert fetch_delay(1000, 1000 + HOUR) == 0
+
+
+def test_due_bucket():
+    assert due_bucket(0) == 0
+    assert due_bucket(DUE_BUCKET_SECONDS - 1) == 0
+    assert due_bucket(DUE_BUCKET_SECONDS) == 1
+    assert due_bucket(str(3 * DUE_BUCKET_SECONDS + 5)) == 3
+    due = next_due(year=2020, last_fetch=ts(2020, 12, 10, 12))
+    assert due_bucket(due) == due // DUE_BUCKET_SECONDS
@@ -0,0 +1,93 @@
+"""
+Binary board snapshots.
+
+    python -m pytest tests
+"""
+import json
+import os
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "htmlgen"), str(ROOT / "shared" / "python"), str(ROOT / "benchmark")]
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from snapshot import BoardSnapshot, source_hash  # noqa E402
+from synthetic import make_leaderboard  # noqa E402
+
+
+def board_json(**kwargs) -> str:
+    return json.dumps(make_leaderboard(**{"members": 50, "days": 25, "seed": 5, **kwargs}))
+
+
+def as_tuple(snapshot: BoardSnapshot) -> tuple:
+    return snapshot.owner_id, snapshot.source, [tuple(_) for _ in snapshot.members]
+
+
+@pytest.mark.parametrize("source", [None, "abc"])
+def test_dumps_loads_round_trip(source):
+    snapshot = BoardSnapshot.from_score(json.loads(board_json()), source)
+    assert as_tuple(BoardSnapshot.loads(snapshot.dumps())) == as_tuple(snapshot)
+
+
+def test_round_trip_keeps_id_types_and_missing_names():
+    score = json.loads(board_json(members=3, days=2))
+    members = list(score["members"].values())
+    members[0]["id"] = "1234"
+    members[1]["id"] = 5678
+    members[2]["name"] = None
+    snapshot = BoardSnapshot.from_score({"owner_id": "42", "members": score["members"]})
+    loaded = BoardSnapshot.loads(snapshot.dumps())
+    assert as_tuple(loaded) == as_tuple(snapshot)
+    assert [type(_.id) for _ in loaded.members[:2]] == [str, int]
+    assert loaded.members[2].name is None
+    assert loaded.owner_id == "42"
+
+
+def test_empty_board_round_trip():
+    snapshot = BoardSnapshot(1, [], "x")
+    assert as_tuple(BoardSnapshot.loads(snapshot.dumps())) == (1, "x", [])
+
+
+def test_loads_rejects_truncated_and_foreign_data():
+    data = BoardSnapshot.from_score(json.loads(board_json(members=5))).dumps()
+    for length in [0, 5, 20, len(data) // 2, len(data) - 1]:
+        with pytest.raises(ValueError):
+            BoardSnapshot.loads(data[:length])
+    with pytest.raises(ValueError):
+        BoardSnapshot.loads(b"XXXX" + data[4:])
+
+
+def test_source_hash_identifies_the_json():
+    raw = board_json()
+    assert source_hash(raw) == source_hash(str(raw))
+    assert source_hash(raw) != source_hash(raw + " ")
+
+
+@pytest.mark.parametrize("raw", [
+    board_json(),
+    board_json(members=1, days=1),
+    json.dumps(make_leaderboard(members=20, days=10, seed=6), indent=4),
+    json.dumps({"event": "2020", "members": {}, "owner_id": 7}),
+    json.dumps({"members": {"1": {"id": 1, "name": None, "local_score": 0, "global_score": 0,
+                                  "stars": 0, "completion_day_level": {}}}, "owner_id": "7"}),
+])
+def test_parse_matches_json_loads(raw):
+    parsed = BoardSnapshot.parse(raw)
+    assert as_tuple(parsed) == as_tuple(BoardSnapshot.from_score(json.loads(raw), source_hash(raw)))
+
+
+@pytest.mark.parametrize("raw", [
+    "",
+    "[]",
+    '{"owner_id": 1}',
+    '{"members": {}}',
+    '{"owner_id": 1, "members": {"1": {"id": 1}}}',
+    '{"owner_id": 1, "members": {"1": []}}',
+    board_json(members=3)[:-10],
+])
+def test_parse_rejects_invalid_leaderboards(raw):
+    with pytest.raises(ValueError):
+        BoardSnapshot.parse(raw)
@@ -0,0 +1,168 @@
+"""
+Lanes and enqueueing in the spawner, against fake SQS queues.
+
+    python -m pytest tests
+"""
+import datetime
+import os
+import pathlib
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "spawner"), str(ROOT / "shared" / "python")]
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+# The spawner looks up its queues when it is imported.
+with mock.patch("boto3.resource"):
+    import spawner  # noqa E402
+
+
+class FakeQueue():
+    """
+    Records send_message_batch calls, failing entries as told by fail(attempt, boardid).
+    attempt counts the sends of the entry from 0, fail returns None (sent),
+    "retry" (a server fault) or "reject" (a sender fault).
+    """
+    def __init__(self, fail=lambda attempt, boardid: None):
+        self.fail = fail
+        self.calls = []
+        self.sent = []
+        self.url = "https://sqs/queue"
+        self.meta = mock.Mock(client=self)
+
+    def send_message_batch(self, QueueUrl: str, Entries: list) -> dict:
+        assert len(Entries) <= spawner.SQS_BATCH_SIZE
+        failed = []
+        for entry in Entries:
+            attempt = sum(_.count(entry['Id']) for _ in self.calls)
+            fault = self.fail(attempt, int(entry['Id'].split("-")[0]))
+            if fault is None:
+                self.sent.append(entry['Id'])
+            else:
+                failed.append({'Id': entry['Id'], 'SenderFault': fault == "reject", 'Code': fault})
+        self.calls.append([_['Id'] for _ in Entries])
+        return {'Failed': failed} if failed else {}
+
+
+def messages(count: int, lane: str = "hot") -> list:
+    return [{'boardid': str(_), 'year': "2020", 'lane': lane} for _ in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(spawner.time, "sleep", lambda _: None)
+
+
+def use_queues(monkeypatch, **queues):
+    monkeypatch.setattr(spawner, "queues", queues)
+
+
+def test_messages_are_sent_in_batches_per_lane(monkeypatch):
+    hot, cold = FakeQueue(), FakeQueue()
+    use_queues(monkeypatch, hot=hot, cold=cold)
+    assert spawner.send_messages(messages(25) + messages(3, "cold")) == 28
+    assert sorted(len(_) for _ in hot.calls) == [5, 10, 10]
+    assert len(hot.sent) == 25
+    assert cold.calls == [["0-2020", "1-2020", "2-2020"]]
+
+
+def test_duplicate_messages_are_sent_once(monkeypatch):
+    hot = FakeQueue()
+    use_queues(monkeypatch, hot=hot)
+    assert spawner.send_messages(messages(3) + messages(3)) == 3
+    assert sorted(hot.sent) == ["0-2020", "1-2020", "2-2020"]
+
+
+def test_failed_entries_are_retried(monkeypatch):
+    # Every other entry fails on the first two attempts.
+    hot = FakeQueue(lambda attempt, boardid: "retry" if attempt < 2 and boardid % 2 else None)
+    use_queues(monkeypatch, hot=hot)
+    assert spawner.send_messages(messages(10)) == 10
+    assert sorted(hot.sent, key=lambda _: int(_.split("-")[0])) == [f"{_}-2020" for _ in range(10)]
+    # Only the failed entries are sent again.
+    assert [len(_) for _ in hot.calls] == [10, 5, 5]
+
+
+def test_rejected_entries_are_not_retried(monkeypatch):
+    hot = FakeQueue(lambda attempt, boardid: "reject" if boardid == 3 else None)
+    use_queues(monkeypatch, hot=hot)
+    assert spawner.send_messages(messages(5)) == 4
+    assert len(hot.calls) == 1
+
+
+def test_entries_are_given_up_after_send_attempts(monkeypatch):
+    hot = FakeQueue(lambda attempt, boardid: "retry" if boardid == 1 else None)
+    use_queues(monkeypatch, hot=hot)
+    assert spawner.send_messages(messages(3)) == 2
+    assert len(hot.calls) == spawner.send_attempts
+
+
+def test_failing_batch_call_is_retried(monkeypatch):
+    hot = FakeQueue()
+    send = hot.send_message_batch
+    calls = []
+
+    def flaky(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise ConnectionError("connection reset")
+        return send(**kwargs)
+
+    hot.meta = mock.Mock(client=mock.Mock(send_message_batch=flaky))
+    use_queues(monkeypatch, hot=hot)
+    assert spawner.send_messages(messages(4)) == 4
+    assert len(calls) == 2
+
+
+def test_no_messages():
+    assert spawner.send_messages([]) == 0
+
+
+def freeze(monkeypatch, *args):
+    """
+    Let the spawner run at the given time in the AoC timezone.
+    """
+    now = spawner.scheduling.TZ.localize(datetime.datetime(*args))
+
+    class Frozen(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now.astimezone(tz)
+
+    monkeypatch.setattr(spawner, "datetime", types.SimpleNamespace(datetime=Frozen, timedelta=datetime.timedelta))
+    return int(now.timestamp())
+
+
+@pytest.mark.parametrize("now, year, expected", [
+    ((2020, 12, 1, 0, 5), "2020", "hot"),
+    ((2020, 12, 31, 23), "2020", "hot"),
+    ((2020, 12, 10), "2019", "cold"),
+    ((2021, 1, 1, 1), "2020", "cold"),
+    ((2021, 11, 30), "2021", "cold"),
+])
+def test_lane_by_year(monkeypatch, now, year, expected):
+    freeze(monkeypatch, *now)
+    assert spawner.lane(year, None) == expected
+    assert spawner.lane(year, {'lastgen': 1}) == expected
+
+
+def test_recently_active_boards_are_hot(monkeypatch):
+    now = freeze(monkeypatch, 2021, 6, 1, 12)
+    period = spawner.hot_active_period
+    assert spawner.lane("2018", {'last_star': now - 60}) == "hot"
+    assert spawner.lane("2018", {'last_star': now - period + 60}) == "hot"
+    assert spawner.lane("2018", {'last_star': now - period - 60}) == "cold"
+    assert spawner.lane("2018", {'lastgen': now}) == "cold"
+
+
+def test_board_message_carries_its_lane(monkeypatch):
+    now = freeze(monkeypatch, 2021, 6, 1, 12)
+    config = {'boardid': "1", 'sessionid': "s", 'title': "t"}
+    hot = spawner.board_message(config, "2018", {'lastgen': 5, 'last_star': now - 60}, {})
+    cold = spawner.board_message(config, "2018", None, {"2018": [1]})
+    assert (hot['lane'], hot['last_timestamp']) == ("hot", 5)
+    assert (cold['lane'], cold['last_timestamp'], cold['nopoint_days']) == ("cold", -1, [1])